@@ -5,79 +5,216 @@
 #License: GNU GPL v3 <www.gnu.org/licenses/gpl.html>
 
 """
-ImgNamer:
-Python script that searches the web to name your images.
+Command-line entry point of ImgNamer:
 
-Functions:
-- img_rename: renames an image at the specified path
-- img_batch_rename: renames all images from a folder at the specified path
+    python -m imgnamer rename IMAGE [IMAGE ...]
+    python -m imgnamer batch FOLDER [-r] [--workers N]
+    python -m imgnamer plan FOLDER PLAN_FILE / apply PLAN_FILE / undo UNDO_FILE
+    python -m imgnamer watch FOLDER [FOLDER ...]
+    python -m imgnamer enqueue QUEUE_FILE FOLDER / work QUEUE_FILE
+
+Engines, parsers and optional dependencies are only imported when a command
+uses them, so that short invocations start quickly. The functions of 'core'
+are also available from this module.
 """
 
 import os
+import sys
 import logging
+import argparse
+
+from .core import (img_rename, img_batch_rename, find_name, rename_group,
+                   supported_ext)
+
+def parser():
+    """Returns the argument parser of the command line."""
+    search = argparse.ArgumentParser(add_help=False)
+    search.add_argument('--method', default='BEST_GUESS',
+                        choices=['BEST_GUESS', 'RESULTS', 'CASCADE'],
+                        help='how names are found (default: BEST_GUESS)')
+    search.add_argument('--engines', nargs='+', default=['GOOGLE'],
+                        help='engines used with RESULTS and CASCADE, '
+                        'preferred first')
+    search.add_argument('--deadline', type=float, default=None,
+                        help='seconds after which slow engines are ignored')
+    search.add_argument('--confidence', type=float, default=None,
+                        help='score of a result stopping the CASCADE method')
+    folders = argparse.ArgumentParser(add_help=False)
+    folders.add_argument('-r', '--recursive', action='store_true',
+                         help='include sub-folders')
+    folders.add_argument('--workers', type=int, default=1,
+                         help='images renamed concurrently (default: 1)')
+
+    main_parser = argparse.ArgumentParser(prog='imgnamer',
+        description='Searches the web to name your images.')
+    main_parser.add_argument('-v', '--verbose', action='store_true')
+    commands = main_parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('rename', parents=[search],
+                                  help='rename images')
+    command.add_argument('images', nargs='+')
+
+    command = commands.add_parser('batch', parents=[search, folders],
+                                  help='rename all images of a folder')
+    command.add_argument('folder')
+    command.add_argument('--dedupe', type=int, default=None,
+                         help='Hamming distance of duplicates (needs Pillow)')
+    command.add_argument('--journal', default=None,
+                         help='journal file used to resume the batch')
+    command.add_argument('--metrics', default=None,
+                         help='file where the per-stage metrics are written')
+    command.add_argument('--processes', type=int, default=None,
+                         help='worker processes, each running --workers '
+                         'threads (default: a single process)')
+    command.add_argument('--queue', default=None,
+                         help='work queue of a multi-process batch, used to '
+                         'resume it or share it with other machines')
+
+    command = commands.add_parser('plan', parents=[search, folders],
+                                  help='write the names of the images of a '
+                                  'folder to a rename plan')
+    command.add_argument('folder')
+    command.add_argument('plan_file')
 
-from . import namer
-from .img_search import search
-from .utils import rename
-from .utils.exceptions import UnknownImageFormat
+    command = commands.add_parser('apply', help='apply a rename plan')
+    command.add_argument('plan_file')
+    command.add_argument('--undo-file', default=None)
+    command.add_argument('--no-verify', action='store_true',
+                         help="don't check that files changed since the plan")
 
-# Set working directory to the namespace where __main__.py is defined
-os.chdir(os.path.dirname(__file__))
+    command = commands.add_parser('undo', help='revert an applied plan')
+    command.add_argument('undo_file')
 
-# Global variable specifying all supported image file extensions
-supported_ext = ['jpg', 'jpeg', 'png', 'gif', 'bmp']
+    command = commands.add_parser('watch', parents=[search, folders],
+                                  help='rename images added to folders')
+    command.add_argument('folders', nargs='+')
+    command.add_argument('--journal', default=None,
+                         help='journal of the files waiting to be renamed')
+    command.add_argument('--initial-scan', action='store_true',
+                         help='also rename the images already in the folders')
 
-def img_rename(filepath, method='BEST_GUESS', engines=None):
+    command = commands.add_parser('enqueue',
+                                  help='add the images of a folder to a work '
+                                  'queue shared by workers')
+    command.add_argument('queue_file')
+    command.add_argument('folder')
+    command.add_argument('-r', '--recursive', action='store_true',
+                         help='include sub-folders')
+
+    command = commands.add_parser('work', parents=[search],
+                                  help='rename the images of a work queue')
+    command.add_argument('queue_file')
+    command.add_argument('--workers', type=int, default=4,
+                         help='images renamed concurrently (default: 4)')
+    return main_parser
+
+def decision(details):
     """
-    Rename an image at the specified path with Google Images suggestion.
-    If the file is not a valid image file, UnknownImageFormat is raised.
-
-    - filepath: path to the image file to rename.
-    - method: string indicating the method used to look for name suggestions.
-    Methods available: BEST_GUESS (default), RESULTS
-    - engines: a list of the reverse image search engines to use with RESULTS
-    method, listed in preffered order.
+    Returns the note printed after a new name: the engine which decided with
+    CASCADE method, or an empty string.
     """
-    extension = os.path.basename(filepath).split('.')[-1]
-    if extension.lower() not in supported_ext:
-        raise UnknownImageFormat("The image extension is not supported.")
-
-    # In all cases, BEST_GUESS is used at least as a hint.
-    hint = namer.best_guess(filepath)
-    if (method == 'BEST_GUESS'):
-        new_name = hint
-    elif (method == 'RESULTS'):
-        # aggregate resuls from the various engines
-        results = []
-        for engine in engines:
-            for res in search(filepath, engine=engine):
-                results.append(res)
-        # use 'suggested_name' function to get an appropriate new name
-        new_name = namer.suggested_name(results, filepath, hint=hint)
-
-    if new_name:
-        rename(filepath, new_name)
-
-def img_batch_rename(folder_path, sub_folders=False, method='BEST_GUESS', engines=None):
+    if not details or details.get('method') != 'CASCADE':
+        return ''
+    if details['decided_by']:
+        return ' (decided by ' + details['decided_by'] + ')'
+    return ' (no confident result from ' + str(details['engine_calls']) \
+        + ' engine(s))'
+
+def main(argv=None):
     """
-    Rename all images in the specified folder with Google Images suggestion.
-
-    Arguments:
-    - folder_path: the path to the folder containing the images to rename.
-    - sub_folders: boolean indicating whether sub_folders are also be included
-    or not (default: False).
-    - method: string indicating the method used to look for name suggestions.
-    Methods available: BEST_GUESS (default), RESULTS
-    - engines: a list of the reverse image search engines to use with RESULTS
-    method, listed in preffered order.
+    Runs the command line given as a list of arguments (default: sys.argv).
+    Returns the exit status: 1 if some images could not be renamed or a plan
+    could not be applied, 2 if a folder given is not a directory.
     """
-    if os.path.isdir(folder_path):
-        l = os.listdir(folder_path)
-        for basename in l:
-            path = os.path.join(folder_path, basename)
-            if os.path.isfile(path):
-                img_rename(path, method=method, engines=engines)
-            elif os.path.isdir(path) and sub_folders:
-                img_batch_rename(path)
-    else:
-        logging.error("No valid directory was found.")
+    main_parser = parser()
+    args = main_parser.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s: %(message)s',
+                        level=logging.INFO if args.verbose else logging.WARNING)
+    if getattr(args, 'confidence', None) is not None:
+        from . import namer
+        namer.confidence = args.confidence
+    search = {'method': getattr(args, 'method', None),
+              'engines': getattr(args, 'engines', None),
+              'deadline': getattr(args, 'deadline', None)}
+
+    folders = getattr(args, 'folders', None) or [getattr(args, 'folder', None)]
+    for folder in folders:
+        if folder is not None and not os.path.isdir(folder):
+            logging.error(folder + ' is not a directory')
+            return 2
+
+    if args.command == 'rename':
+        status = 0
+        for path in args.images:
+            details = {}
+            try:
+                new_path = img_rename(path, details=details, **search)
+            except Exception as e:
+                logging.error(path + ': ' + str(e))
+                new_path = None
+            if new_path:
+                print(path + ' -> ' + new_path + decision(details))
+            else:
+                status = 1
+        return status
+    elif args.command == 'batch':
+        details = {}
+        if args.processes or args.queue:
+            # Worker processes have no journal, duplicate groups or metrics
+            ignored = [option for option, value in (('--dedupe', args.dedupe),
+                ('--journal', args.journal), ('--metrics', args.metrics))
+                if value is not None]
+            if ignored:
+                main_parser.error(', '.join(ignored) + ' cannot be used with '
+                                  '--processes or --queue')
+            from .workers import img_process_rename
+            results = img_process_rename(args.folder,
+                sub_folders=args.recursive, processes=args.processes,
+                workers=args.workers, queue_file=args.queue, **search)
+        else:
+            results = img_batch_rename(args.folder, sub_folders=args.recursive,
+                workers=args.workers, dedupe=args.dedupe,
+                journal=args.journal, metrics_file=args.metrics,
+                details=details, **search)
+        for path, new_path in results.items():
+            if isinstance(new_path, str):
+                print(path + ' -> ' + new_path + decision(details.get(path)))
+        return int(not all(isinstance(new_path, str)
+                           for new_path in results.values()))
+    elif args.command == 'plan':
+        from .plan import img_plan
+        written = img_plan(args.folder, args.plan_file,
+            sub_folders=args.recursive, workers=args.workers, **search)
+        print(str(written) + ' entries written to ' + args.plan_file)
+    elif args.command == 'apply':
+        from .plan import apply_plan
+        try:
+            renamed = apply_plan(args.plan_file, args.undo_file,
+                                 verify=not args.no_verify)
+        except Exception as e:
+            # The renames already done were rolled back by 'apply_plan'
+            logging.error('The plan was not applied: ' + str(e))
+            return 1
+        for path, new_path in renamed:
+            print(path + ' -> ' + new_path)
+    elif args.command == 'undo':
+        from .plan import undo
+        print(str(undo(args.undo_file)) + ' files restored')
+    elif args.command == 'enqueue':
+        from .workers import enqueue
+        added = enqueue(args.queue_file, args.folder,
+                        sub_folders=args.recursive)
+        print(str(added) + ' files added to ' + args.queue_file)
+    elif args.command == 'work':
+        from .workers import work
+        print(str(work(args.queue_file, workers=args.workers, **search))
+              + ' files processed')
+    elif args.command == 'watch':
+        from .watch import img_watch
+        img_watch(args.folders, sub_folders=args.recursive,
+            workers=args.workers, journal=args.journal,
+            initial_scan=args.initial_scan, **search)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+# Synthetic image corpus for benchmarks: valid PNG files of various sizes with
+# distinct contents, written with core modules only.
+
+import os
+import zlib
+import struct
+import random
+
+def png_bytes(width, height, seed=0):
+    """Returns the content of a grey PNG image with pseudo-random pixels."""
+    rng = random.Random(seed)
+    rows = b''.join(b'\0' + bytes(rng.getrandbits(8) for i in range(width))
+                    for j in range(height))
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows))
+            + chunk(b'IEND', b''))
+
+def make_corpus(directory, count, min_edge=64, max_edge=256, seed=0):
+    """
+    Writes 'count' distinct PNG images in 'directory' and returns their paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, 'IMG_%05d.png' % i)
+        width = rng.randint(min_edge, max_edge)
+        height = rng.randint(min_edge, max_edge)
+        with open(path, 'wb') as f:
+            f.write(png_bytes(width, height, seed=seed * 1000003 + i))
+        paths.append(path)
+    return paths
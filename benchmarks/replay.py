@@ -0,0 +1,131 @@
+# Local HTTP server replaying recorded engine responses, so that benchmarks run
+# offline and measure imgnamer itself rather than the engines. Recorded pages
+# are read from a fixtures directory, where '{host}' and '{page}' placeholders
+# are replaced by the server address and the requested page.
+
+import os
+import time
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from ..search import google, tineye
+
+fixtures_dir = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """Request handler serving the fixtures of a ReplayServer."""
+
+    protocol_version = 'HTTP/1.1'   # Keep connections alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None):
+        time.sleep(self.server.latency)
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _page(self, name, page=''):
+        body = self.server.fixture(name)
+        body = body.replace('{host}', self.server.url).replace('{page}', page)
+        self._send(200, body.encode('utf-8'))
+
+    def do_POST(self):
+        # Consume the uploaded image before answering
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        self.server.count('upload', length)
+        url = urlparse(self.path)
+        if url.path == '/searchbyimage/upload':
+            location = self.server.url + '/search?tbs=sbi:replay'
+        elif url.path == '/tineye/search':
+            location = self.server.url + '/tineye/result/replay'
+        else:
+            return self._send(404)
+        self._send(302, headers={'Location': location})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.server.count(url.path.split('/')[1])
+        if url.path == '/search' and 'tbm' in query:
+            self._page('google_images.html')
+        elif url.path == '/search':
+            start = int(query.get('start', ['0'])[0])
+            if start // 10 < self.server.pages:
+                self._page('google_results.html', str(start // 10 + 1))
+            else:
+                self._page('empty.html')
+        elif url.path.startswith('/tineye/result/'):
+            page = int(query.get('page', ['1'])[0])
+            if page <= self.server.pages:
+                self._page('tineye_results.html', str(page))
+            else:
+                self._page('empty.html')
+        elif url.path.startswith('/source/'):
+            self._page('source_page.html', url.path.split('/')[-1])
+        else:
+            self._send(404)
+
+class ReplayServer(ThreadingHTTPServer):
+    """HTTP server replaying recorded responses of the search engines.
+
+    Arguments:
+        - fixtures: directory of the recorded pages (default: 'fixtures_dir')
+        - latency: delay in seconds added to every response (default = 0)
+        - pages: number of results pages served per search (default = 2)
+    """
+    daemon_threads = True
+
+    def __init__(self, fixtures=None, latency=0, pages=2):
+        super().__init__(('127.0.0.1', 0), ReplayHandler)
+        self.fixtures = fixtures or fixtures_dir
+        self.latency = latency
+        self.pages = pages
+        self.url = 'http://127.0.0.1:' + str(self.server_address[1])
+        self.requests = {}
+        self.bytes_received = 0
+        self._fixtures = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def fixture(self, name):
+        if name not in self._fixtures:
+            with open(os.path.join(self.fixtures, name), encoding='utf-8') as f:
+                self._fixtures[name] = f.read()
+        return self._fixtures[name]
+
+    def count(self, kind, size=0):
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+            self.bytes_received = self.bytes_received + size
+
+    def start(self):
+        """
+        Serves requests in a background thread and points the engines' base
+        URLs at the server.
+        """
+        self._saved = (google.baseUrl, tineye.baseUrl)
+        google.baseUrl = self.url + '/searchbyimage/upload'
+        tineye.baseUrl = self.url + '/tineye/search'
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the server and restores the engines' base URLs."""
+        self.shutdown()
+        self.server_close()
+        google.baseUrl, tineye.baseUrl = self._saved
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
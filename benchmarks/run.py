@@ -0,0 +1,129 @@
+# Offline benchmarks of imgnamer. Engines are replaced by a local replay server
+# and images by a synthetic corpus, so that results only depend on imgnamer.
+#
+# Usage: python -m imgnamer.benchmarks.run [--images N] [--workers N]
+#        [--latency SECONDS] [--method RESULTS] [--engines GOOGLE TINEYE ...]
+#        [--metrics FILE]
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+from .. import cache, metrics, name_index, relevance
+from ..core import img_rename, img_batch_rename
+from ..search import SearchResult, transport
+from ..search import utils as search_utils
+from ..search.parsing import parse
+from ..utils.size import get_image_size, probe_image_size
+from .replay import ReplayServer, fixtures_dir
+from .corpus import make_corpus
+
+def measure(function, repeat):
+    """Returns the mean duration in seconds of 'repeat' calls of 'function'."""
+    start = time.perf_counter()
+    for i in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+def report(name, seconds, unit='ms'):
+    factor = {'ms': 1e3, 'us': 1e6}[unit]
+    print('  %-44s %10.3f %s' % (name, seconds * factor, unit))
+
+def bench_rename(directory, args):
+    """Renames the corpus one image at a time and reports per-image latency."""
+    paths = make_corpus(os.path.join(directory, 'single'), args.images, seed=1)
+    latencies = []
+    for path in paths:
+        start = time.perf_counter()
+        img_rename(path, method=args.method, engines=args.engines)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print('img_rename (%d images)' % len(paths))
+    report('mean latency', statistics.mean(latencies))
+    report('median latency', statistics.median(latencies))
+    report('p95 latency', latencies[int(0.95 * (len(latencies) - 1))])
+    print('  %-44s %10.1f' % ('images per second', len(paths) / sum(latencies)))
+
+def bench_batch(directory, args):
+    """Renames the corpus in batch and reports the throughput."""
+    folder = os.path.join(directory, 'batch')
+    paths = make_corpus(folder, args.images, seed=2)
+    start = time.perf_counter()
+    img_batch_rename(folder, method=args.method, engines=args.engines,
+                     workers=args.workers)
+    elapsed = time.perf_counter() - start
+    print('img_batch_rename (%d images, %d workers)'
+          % (len(paths), args.workers))
+    report('total', elapsed)
+    print('  %-44s %10.1f' % ('images per second', len(paths) / elapsed))
+
+def bench_micro(directory, args):
+    """Micro-benchmarks of scoring, size probing and HTML parsing."""
+    path = make_corpus(os.path.join(directory, 'micro'), 1, seed=3)[0]
+    results = [SearchResult(('1200', '900'), 'Dragon %d by Artist on DeviantArt'
+                            % i, 'https://www.deviantart.com/art/%d' % i, '')
+               for i in range(100)]
+    print('micro-benchmarks')
+    report('relevance.score (100 results)', measure(lambda: [relevance.score(
+        res, original_file=path, hint='Dragon Artist') for res in results],
+        50))
+    report('relevance.score_batch (100 results)', measure(
+        lambda: relevance.score_batch(results, original_file=path,
+                                      hint='Dragon Artist'), 50))
+    report('get_image_size (memoized)', measure(
+        lambda: get_image_size(path), 10000), 'us')
+    report('probe_image_size', measure(lambda: probe_image_size(path), 10000),
+           'us')
+
+    pages = [('google_results.html', 'GOOGLE'),
+             ('google_results.html', 'GOOGLE_PAGE'),
+             ('google_images.html', 'GOOGLE_IMAGES'),
+             ('tineye_results.html', 'TINEYE')]
+    for name, page in pages:
+        with open(os.path.join(fixtures_dir, name), 'rb') as f:
+            content = f.read()
+        report('parse %s (full tree)' % name, measure(
+            lambda: parse(content), 200), 'us')
+        report('parse %s (%s)' % (name, page), measure(
+            lambda: parse(content, page), 200), 'us')
+
+def main():
+    parser = argparse.ArgumentParser(description='imgnamer offline benchmarks')
+    parser.add_argument('--images', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='delay in seconds added to every response')
+    parser.add_argument('--method', default='RESULTS')
+    parser.add_argument('--engines', nargs='+',
+                        default=['GOOGLE', 'GOOGLE_IMAGES', 'TINEYE'])
+    parser.add_argument('--fixtures', default=None,
+                        help='directory of recorded responses')
+    parser.add_argument('--metrics', default=None,
+                        help='file where the per-stage metrics are written')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='imgnamer-bench-')
+    os.environ['IMGNAMER_CACHE_DIR'] = os.path.join(directory, 'data')
+    # Every image must go to the (replayed) engines
+    cache.configure(enabled=False)
+    name_index.configure(enabled=False)
+    # The replay server is the only host: its pool must keep the connections
+    # of all the engines, prefetches and page titles at once
+    transport.configure(pool_maxsize=args.workers * len(args.engines)
+        + search_utils.prefetch_workers + search_utils.title_workers)
+    try:
+        with ReplayServer(fixtures=args.fixtures, latency=args.latency) as server:
+            bench_rename(directory, args)
+            bench_batch(directory, args)
+            print('replay server requests: %s' % sorted(server.requests.items()))
+        if args.metrics:
+            metrics.export_json(args.metrics)
+        bench_micro(directory, args)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
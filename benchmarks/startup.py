@@ -0,0 +1,63 @@
+# Startup time of the command line. Each command is run in a fresh interpreter,
+# and the heavy dependencies loaded by importing the entry point are listed, so
+# that an eager import added somewhere shows up immediately.
+#
+# Usage: python -m imgnamer.benchmarks.startup [--repeat N]
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+import statistics
+
+package = __package__.rpartition('.')[0]
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that short invocations should not need to import
+heavy_modules = ['requests', 'urllib3', 'bs4', 'lxml', 'numpy', 'PIL',
+                 package + '.search.google', package + '.search.google_images',
+                 package + '.search.tineye', package + '.relevance']
+
+def run(args, repeat):
+    """
+    Returns the median wall time in seconds of 'repeat' runs of the Python
+    interpreter with 'args', from the folder containing the package.
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    durations = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=os.path.dirname(package_dir),
+                       env=env, stdout=subprocess.DEVNULL, check=True)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+def loaded_modules():
+    """Returns the heavy modules loaded by importing the entry point."""
+    code = ('import sys, %s.__main__; print(" ".join(m for m in %r '
+            'if m in sys.modules))' % (package, heavy_modules))
+    out = subprocess.run([sys.executable, '-c', code],
+                         cwd=os.path.dirname(package_dir),
+                         capture_output=True, text=True, check=True)
+    return out.stdout.split()
+
+def main():
+    parser = argparse.ArgumentParser(description='imgnamer startup time')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print('startup time (median of %d runs)' % args.repeat)
+    commands = [('python (baseline)', ['-c', 'pass']),
+                ('import %s.__main__' % package,
+                 ['-c', 'import %s.__main__' % package]),
+                ('python -m %s --help' % package, ['-m', package, '--help']),
+                ('python -m %s rename --help' % package,
+                 ['-m', package, 'rename', '--help'])]
+    for name, command in commands:
+        print('  %-44s %10.1f ms' % (name, run(command, args.repeat) * 1e3))
+    print('heavy modules imported by the entry point: %s'
+          % (' '.join(loaded_modules()) or 'none'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# This module implements a persistent cache of search results, stored in a
+# single SQLite file. Entries are keyed by the hash of the image content, so
+# that an image already searched is never sent to the engines again, even if it
+# has been moved or renamed in the meantime.
+
+import json
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+
+from .search.result import SearchResult
+from .utils.hashing import file_hash
+from .utils.paths import data_path
+
+# Cache settings (see 'configure')
+path = None             # Path of the SQLite file (default: data directory)
+ttl = 30 * 24 * 3600    # Lifetime of an entry in seconds (None: no expiry)
+max_entries = 100000    # Least recently used entries are evicted beyond that
+enabled = True          # When False, the cache is neither read nor written
+refresh = False         # When True, cached entries are ignored but replaced
+
+# Access times of the entries read are written in batches of 'flush_every',
+# and the number of entries is only checked every 'evict_every' insertions,
+# so that reads and writes do not each cost a disk write or a table scan
+flush_every = 256
+evict_every = 1000
+
+_connection = None
+_lock = threading.Lock()
+_accessed = {}          # Key -> access time not written yet
+_inserts = 0            # Insertions since the number of entries was checked
+
+def configure(**settings):
+    """
+    Changes the cache settings: path, ttl, max_entries, enabled, refresh,
+    flush_every, evict_every. Changing the path closes the current database.
+    """
+    global _connection
+    with _lock:
+        for name, value in settings.items():
+            if name not in ('path', 'ttl', 'max_entries', 'enabled', 'refresh',
+                            'flush_every', 'evict_every'):
+                raise TypeError("Unknown cache setting '" + name + "'")
+            globals()[name] = value
+        if 'path' in settings and _connection:
+            _flush()
+            _connection.close()
+            _connection = None
+
+def _db():
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(path or data_path('search.sqlite'),
+            check_same_thread=False)
+        _connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)')
+        _connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed '
+            'ON entries (accessed)')
+        _connection.commit()
+    return _connection
+
+def _flush():
+    # Called with '_lock' held
+    if _accessed and _connection is not None:
+        _connection.executemany('UPDATE entries SET accessed = ? WHERE key = ?',
+            [(accessed, key) for key, accessed in _accessed.items()])
+        _connection.commit()
+    _accessed.clear()
+
+def flush():
+    """Writes the access times of the entries read to the database."""
+    try:
+        with _lock:
+            _flush()
+    except sqlite3.Error as e:
+        logging.warning('Search cache: ' + str(e))
+
+atexit.register(flush)
+
+def get(key):
+    """
+    Returns the value stored under 'key' (any JSON serializable object), or
+    None if there is no valid entry.
+    """
+    if not enabled or refresh:
+        return None
+    key = json.dumps(key)
+    now = time.time()
+    try:
+        with _lock:
+            db = _db()
+            row = db.execute('SELECT value, created FROM entries WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+            if ttl is not None and now - row[1] > ttl:
+                _accessed.pop(key, None)
+                db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                db.commit()
+                return None
+            _accessed[key] = now
+            if len(_accessed) >= flush_every:
+                _flush()
+            return json.loads(row[0])
+    except sqlite3.Error as e:
+        logging.warning('Search cache: ' + str(e))
+        return None
+
+def put(key, value):
+    """
+    Stores 'value' (any JSON serializable object) under 'key'.
+    Least recently used entries are evicted every 'evict_every' insertions
+    once there are more than 'max_entries'.
+    """
+    global _inserts
+    if not enabled:
+        return
+    key = json.dumps(key)
+    now = time.time()
+    try:
+        with _lock:
+            db = _db()
+            _accessed.pop(key, None)
+            db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now, now))
+            _inserts = _inserts + 1
+            # Small caches are checked more often, not to grow far beyond
+            if (max_entries is not None
+                    and _inserts >= min(evict_every, max_entries)):
+                _inserts = 0
+                _flush()
+                count = db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+                if count > max_entries:
+                    db.execute('DELETE FROM entries WHERE key IN (SELECT key '
+                        'FROM entries ORDER BY accessed LIMIT ?)',
+                        (count - max_entries,))
+            db.commit()
+    except sqlite3.Error as e:
+        logging.warning('Search cache: ' + str(e))
+
+def clear():
+    """Removes all entries from the cache."""
+    with _lock:
+        _accessed.clear()
+        _db().execute('DELETE FROM entries')
+        _db().commit()
+
+def _results_key(filepath, engine, num, params, stop=None):
+    key = [file_hash(filepath), engine, num, sorted(params.items())]
+    return key + ['STOP', stop] if stop is not None else key
+
+def get_results(filepath, engine, num, params, stop=None):
+    """
+    Returns the cached list of SearchResult objects for an image search, or
+    None if the search has not been cached. Lists cut short by a stop
+    condition are cached apart from complete ones, under the settings of the
+    condition given as 'stop' (a JSON serializable list).
+    """
+    value = get(_results_key(filepath, engine, num, params, stop))
+    if value is None:
+        return None
+    return [SearchResult.from_dict(res) for res in value]
+
+def put_results(filepath, engine, num, params, results, stop=None):
+    """Stores the list of SearchResult objects of an image search."""
+    put(_results_key(filepath, engine, num, params, stop),
+        [res.to_dict() for res in results])
+
+def get_hint(filepath):
+    """Returns the cached best guess of an image, or None."""
+    return get([file_hash(filepath), 'BEST_GUESS'])
+
+def put_hint(filepath, hint):
+    """Stores the best guess of an image."""
+    put([file_hash(filepath), 'BEST_GUESS'], hint)
@@ -0,0 +1,284 @@
+#ImgNamer
+#The python script that searches the web to name your images
+#Author: Dorian Daudier <daudierd@users.noreply.github.com>
+#Version 1.0
+#License: GNU GPL v3 <www.gnu.org/licenses/gpl.html>
+
+"""
+ImgNamer:
+Python script that searches the web to name your images.
+
+Functions:
+- img_rename: renames an image at the specified path
+- img_batch_rename: renames all images from a folder at the specified path
+- find_name: finds the name of an image without renaming it
+"""
+
+import os
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from . import namer
+from . import name_index
+from . import metrics
+from .img_search import search_all, set_engine_limit
+from .search import transport
+from .journal import Journal, PENDING, SEARCHED, RENAMED, FAILED
+from .utils import rename, file_hash
+from .utils.walk import walk_files
+from .utils.pool import bounded_map
+from .utils.exceptions import UnknownImageFormat
+
+# Global variable specifying all supported image file extensions
+supported_ext = ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'tif', 'tiff',
+                 'heic', 'heif', 'avif']
+
+def img_rename(filepath, method='BEST_GUESS', engines=None, deadline=None,
+               details=None):
+    """
+    Rename an image at the specified path with Google Images suggestion.
+    If the file is not a valid image file, UnknownImageFormat is raised.
+
+    - filepath: path to the image file to rename.
+    - method: string indicating the method used to look for name suggestions.
+    Methods available: BEST_GUESS (default), RESULTS, CASCADE
+    - engines: a list of the reverse image search engines to use with RESULTS
+    method, listed in preffered order. They are queried concurrently, except
+    with CASCADE method where they are queried in order until a result is
+    confident enough (see 'namer.cascade').
+    - deadline: (optional) time in seconds after which the engines that have
+    not answered are ignored with RESULTS method.
+    - details: (optional) dictionary updated with the details of the name
+    suggestion (see 'find_name'), e.g. the engine which decided with CASCADE
+    method.
+
+    Images close enough to an image already named are given the same name
+    without searching the web (see 'name_index').
+
+    Returns the new path of the image, or None if it was not renamed.
+    """
+    new_name, found = find_name(filepath, method=method, engines=engines,
+                                deadline=deadline)
+    if details is not None:
+        details.update(found)
+    if new_name:
+        new_path = rename(filepath, new_name)
+        if found['method'] != 'INDEX':
+            name_index.record(new_path, new_name, found.get('location'))
+        return new_path
+    return None
+
+def find_name(filepath, method='BEST_GUESS', engines=None, deadline=None):
+    """
+    Returns the name suggested for an image without renaming it (an empty
+    string if no name could be found), and a dictionary of details on the
+    suggestion: 'method' (INDEX, BEST_GUESS, RESULTS or CASCADE), the 'engine'
+    and 'location' of the source of the name and, with RESULTS and CASCADE
+    methods, the 'score' breakdown of the chosen result. With CASCADE method,
+    'decided_by' is the engine whose result stopped the cascade (None if all
+    engines were queried) and 'engine_calls' the number of engines queried.
+    Arguments are those of 'img_rename'.
+    """
+    extension = os.path.basename(filepath).split('.')[-1]
+    if extension.lower() not in supported_ext:
+        raise UnknownImageFormat("The image extension is not supported.")
+
+    # Names given to similar images are reused without going to the network
+    match = name_index.lookup(filepath)
+    if match:
+        name, location, distance = match
+        return name, {'method': 'INDEX', 'engine': None, 'location': location,
+                      'distance': distance}
+
+    # In all cases, BEST_GUESS is used at least as a hint.
+    hint = namer.best_guess(filepath)
+    if (method == 'BEST_GUESS'):
+        return hint, {'method': method, 'engine': 'GOOGLE', 'location': None}
+    elif (method == 'RESULTS'):
+        # aggregate resuls from the various engines
+        results = search_all(filepath, engines, deadline=deadline)
+        # rank the results to get an appropriate new name
+        ranked = namer.rank(results, filepath, hint=hint)
+        if not ranked:
+            return '', {'method': method, 'engine': None, 'location': None}
+        best, breakdown = ranked[0]
+        return namer.prettify(best.title or ''), {'method': method,
+            'engine': best.engine, 'location': best.location,
+            'score': breakdown}
+    elif (method == 'CASCADE'):
+        # query the engines in preferred order until one is good enough
+        ranked, cascade = namer.cascade(filepath, engines, hint=hint)
+        logging.info(os.path.basename(filepath) + ': decided by '
+            + str(cascade['decided_by']) + ' after '
+            + str(cascade['engine_calls']) + ' engine(s)')
+        if not ranked:
+            return '', dict(cascade, method=method, engine=None,
+                            location=None)
+        best, breakdown = ranked[0]
+        return namer.prettify(best.title or ''), dict(cascade, method=method,
+            engine=best.engine, location=best.location, score=breakdown)
+    return '', {'method': method, 'engine': None, 'location': None}
+
+def rename_group(group, method='BEST_GUESS', engines=None, deadline=None,
+                 journal=None, produced=None, details=None):
+    """
+    Renames a group of duplicate images (or a single image) with the name
+    found for its first image. Arguments are those of 'img_batch_rename';
+    the new paths are added to the set 'produced' if one is given, and the
+    details of the name suggestion to the dictionary 'details' for each path.
+
+    Returns a list of (path, new path or exception) pairs.
+    """
+    # Files renamed by a previous run are skipped. Other copies of the same
+    # content are not: they have entries of their own.
+    keys = {}
+    out = []
+    if journal:
+        for path in group:
+            if path.split('.')[-1].lower() not in supported_ext:
+                continue
+            try:
+                keys[path] = file_hash(path)
+                entry = journal.get(path, key=keys[path])
+            except OSError:
+                entry = None
+            if (entry and entry['state'] == RENAMED
+                    and entry['new_path'] == path):
+                out.append((path, path))
+        skipped = set(path for path, new_path in out)
+        group = [path for path in group if path not in skipped]
+        if not group:
+            return out
+
+    def mark(path, state, **kwargs):
+        if path in keys:
+            journal.mark(path, state, key=keys[path], **kwargs)
+
+    # The first image of a group is searched, then the group is renamed in
+    # order so that numbered suffixes are deterministic
+    entry = journal.get(group[0], key=keys[group[0]]) \
+        if group[0] in keys else None
+    try:
+        if entry and entry['state'] == SEARCHED and entry['name']:
+            name, found = entry['name'], {'method': 'JOURNAL'}
+        else:
+            for path in group:
+                mark(path, PENDING)
+            name, found = find_name(group[0], method=method,
+                                    engines=engines, deadline=deadline)
+            for path in group:
+                if name:
+                    mark(path, SEARCHED, name=name)
+                else:
+                    mark(path, FAILED, error='No name found')
+    except Exception as e:
+        logging.error(os.path.basename(group[0]) + ': ' + str(e))
+        for path in group:
+            mark(path, FAILED, error=e)
+        return out + [(path, e) for path in group]
+    if details is not None:
+        for path in group:
+            details[path] = found
+
+    renamed = []
+    for path in group:
+        try:
+            new_path = rename(path, name, reserved=produced) if name else None
+            if new_path:
+                mark(path, RENAMED, new_path=new_path)
+            renamed.append((path, new_path))
+        except Exception as e:
+            logging.error(os.path.basename(path) + ': ' + str(e))
+            mark(path, FAILED, error=e)
+            renamed.append((path, e))
+    if (name and found['method'] not in ('INDEX', 'JOURNAL')
+            and isinstance(renamed[0][1], str)):
+        name_index.record(renamed[0][1], name, found.get('location'))
+    return out + renamed
+
+def img_batch_rename(folder_path, sub_folders=False, method='BEST_GUESS',
+                     engines=None, workers=1, engine_limits=None,
+                     deadline=None, dedupe=None, journal=None,
+                     metrics_file=None, details=None, **filters):
+    """
+    Rename all images in the specified folder with Google Images suggestion.
+
+    Arguments:
+    - folder_path: the path to the folder containing the images to rename.
+    - sub_folders: boolean indicating whether sub_folders are also be included
+    or not (default: False).
+    - method: string indicating the method used to look for name suggestions.
+    Methods available: BEST_GUESS (default), RESULTS, CASCADE
+    - engines: a list of the reverse image search engines to use with RESULTS
+    and CASCADE methods, listed in preffered order.
+    - workers: number of images renamed concurrently (default: 1).
+    - engine_limits: (optional) a dictionary giving the maximum number of
+    concurrent requests per engine, e.g. {'GOOGLE': 4, 'TINEYE': 2}.
+    - deadline: (optional) time in seconds after which the engines that have
+    not answered are ignored for an image with RESULTS method.
+    - dedupe: (optional) maximum Hamming distance between the perceptual hashes
+    of two images considered as duplicates (requires Pillow). Only one image
+    per group of duplicates is searched, and its name is given to the whole
+    group with numbered suffixes, e.g. 'Name', 'Name (2)', 'Name (3)'.
+    - journal: (optional) path to the journal of the run, or a Journal object.
+    When the same journal is given again, files already renamed are skipped,
+    names already found are reused and only failures are searched again.
+    - metrics_file: (optional) path to a file where the JSON summary of the
+    time spent in each stage by the batch is written at its end. Batches run
+    concurrently in the same process are counted together.
+    - details: (optional) dictionary in which the details of the name
+    suggestion of each file searched are stored (see 'find_name').
+    - filters: (optional) criteria on the files to rename, as keyword arguments
+    of 'utils.walk.walk_files': min_size, max_size, min_mtime, max_mtime,
+    include and exclude. Only files with a supported extension are renamed.
+
+    Files are renamed as the folder is scanned, except with 'dedupe' which
+    needs all the images to be hashed first.
+
+    Returns a dictionary mapping each file path to its new path (None if the
+    file was not renamed), or to the exception raised while renaming it.
+    """
+    if not os.path.isdir(folder_path):
+        logging.error("No valid directory was found.")
+        return {}
+    # Only the measurements of this batch are exported
+    started = metrics.snapshot() if metrics_file else None
+
+    for engine, limit in (engine_limits or {}).items():
+        set_engine_limit(engine, limit)
+    # Keep enough connections alive for all workers
+    if workers > transport.pool_maxsize:
+        transport.configure(pool_maxsize=workers)
+
+    opened = isinstance(journal, str)
+    if opened:
+        journal = Journal(journal)
+
+    # Files renamed by this run may show up again while folders are scanned
+    produced = set()
+    files = (path for path in walk_files(folder_path, sub_folders=sub_folders,
+                                         extensions=supported_ext, **filters)
+             if path not in produced)
+    if dedupe is not None:
+        from .utils.phash import group_duplicates
+        groups = group_duplicates(list(files), max_distance=dedupe)
+    else:
+        groups = ([path] for path in files)
+
+    task = functools.partial(rename_group, method=method, engines=engines,
+        deadline=deadline, journal=journal, produced=produced,
+        details=details)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # Only a bounded number of groups is submitted ahead of the workers
+        for out in bounded_map(executor, task, groups, 2 * max(1, workers)):
+            results.update(out)
+    if journal:
+        logging.info(str(journal.count(RENAMED)) + " files renamed, "
+            + str(journal.count(FAILED)) + " failures in journal")
+        if opened:
+            journal.close()
+    if metrics_file:
+        metrics.export_json(metrics_file, since=started)
+    return results
@@ -1,11 +1,79 @@
 import os
 import logging
 import re
+import threading
+import functools
+import contextlib
+import importlib
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-import bs4
+from . import cache
+from .search import transport
 
-from .search import google, google_images, tineye
+# Maximum number of concurrent requests allowed per engine. Engines that are
+# not listed are not limited.
+engine_limits = {}
+_semaphores = {}
+_semaphores_guard = threading.Lock()
+
+def set_engine_limit(engine, limit):
+    """
+    Limits the number of concurrent searches sent to 'engine'.
+    A limit of None removes the restriction.
+    """
+    with _semaphores_guard:
+        if limit is None:
+            engine_limits.pop(engine, None)
+            _semaphores.pop(engine, None)
+        else:
+            engine_limits[engine] = limit
+            _semaphores[engine] = threading.BoundedSemaphore(limit)
+
+def engine_slot(engine):
+    """
+    Returns a context manager holding one of the concurrency slots of 'engine'
+    for the duration of a request.
+    """
+    with _semaphores_guard:
+        semaphore = _semaphores.get(engine)
+    return semaphore if semaphore else contextlib.nullcontext()
+
+# Threads running the searches of 'search_engines', per engine (see '_submit')
+_executors = {}
+_executors_guard = threading.Lock()
+
+# Engine modules by name, imported the first time an engine is used
+engines = {'GOOGLE': 'google', 'GOOGLE_IMAGES': 'google_images',
+           'TINEYE': 'tineye'}
+
+def engine_module(engine):
+    """Returns the module of 'engine' from the 'search' package."""
+    return importlib.import_module('.search.' + engines[engine], __package__)
+
+def iter_search(filepath, engine='GOOGLE', num=None, **params):
+    """
+    Performs a reverse image search and generates SearchResult objects as the
+    results pages are parsed, so that callers may stop early. Results pages are
+    not cached, and one concurrency slot of the engine is held until the
+    generator is exhausted or closed.
+
+    Arguments:
+        - filepath: the path to the image file to search
+    Optional:
+        - engine (GOOGLE | GOOGLE_IMAGES | TINEYE): The search engine used
+        (default = 'GOOGLE')
+        - num: Maximum number of results taken, so that no page is fetched
+        ahead needlessly (default: all)
+        - params: a dictionary of search GET parameters
+    """
+    if engine not in engines:
+        print("Unsupported search engine")
+        return
+    with engine_slot(engine):
+        for res in engine_module(engine).iter_results(filepath, num=num,
+                                                      **params):
+            res.engine = engine
+            yield res
 
 def search(filepath, engine='GOOGLE', num=5, **params):
     """
@@ -18,13 +86,90 @@ def search(filepath, engine='GOOGLE', num=5, **params):
         (default = 'GOOGLE')
         - num: Maximum number of search results to return (default = 5)
         - params: a dictionary of search GET parameters
+
+    Results are read from the search cache when the same image has already
+    been searched with the same arguments.
     """
-    if (engine == 'GOOGLE'):
-        return google.search(filepath, num=num, **params)
-    elif (engine == 'GOOGLE_IMAGES'):
-        return google_images.search(filepath, num=num, **params)
-    elif (engine == 'TINEYE'):
-        return tineye.search(filepath, num=num, **params)
-    else:
+    cached = cache.get_results(filepath, engine, num, params)
+    if cached is not None:
+        for res in cached:
+            res.engine = engine
+        return cached
+
+    if engine not in engines:
         print("Unsupported search engine")
         return []
+    with engine_slot(engine):
+        results = engine_module(engine).search(filepath, num=num, **params)
+    for res in results:
+        res.engine = engine
+    # Empty lists are not cached as they may result from a network error
+    if results:
+        cache.put_results(filepath, engine, num, params, results)
+    return results
+
+def _submit(loop, engine, function):
+    """
+    Runs 'function' in the threads of 'engine' shared by all the images: as
+    many as its concurrency limit, or as the connections kept alive per host
+    when it is not limited, so that searches queue for a thread rather than
+    hold one while they wait for a slot.
+    """
+    size = engine_limits.get(engine) or transport.pool_maxsize
+    with _executors_guard:
+        executor, workers = _executors.get(engine, (None, None))
+        if workers != size:
+            # Searches already submitted to the previous threads still run
+            if executor is not None:
+                executor.shutdown(wait=False)
+            executor = ThreadPoolExecutor(max_workers=size,
+                thread_name_prefix='imgnamer-' + engine.lower())
+            _executors[engine] = (executor, size)
+        return loop.run_in_executor(executor, function)
+
+async def search_engines(filepath, engines, num=5, deadline=None, **params):
+    """
+    Queries several engines concurrently for one image and returns the merged
+    list of SearchResult objects. Results are merged in the order of 'engines'
+    (preferred first), so that ties are broken in favour of preferred engines.
+
+    Arguments:
+        - filepath: the path to the image file to search
+        - engines: a list of engines, listed in preferred order
+    Optional:
+        - num: Maximum number of search results per engine (default = 5)
+        - deadline: time in seconds after the call after which the engines
+        that have not answered are dropped, whether they were still waiting
+        for a thread or a concurrency slot or already searching (default: no
+        deadline)
+        - params: a dictionary of search GET parameters
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    tasks = [_submit(loop, engine, functools.partial(search, filepath,
+        engine=engine, num=num, **params)) for engine in engines or []]
+    if not tasks:
+        return []
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+
+    results = []
+    for engine, task in zip(engines, tasks):
+        if task in pending:
+            # Searches which have not started yet are not sent at all
+            task.cancel()
+            logging.warning(engine + " dropped after deadline for "
+                + os.path.basename(filepath))
+        elif task.exception():
+            logging.error(engine + ": " + str(task.exception()))
+        else:
+            results.extend(task.result())
+    return results
+
+def search_all(filepath, engines, num=5, deadline=None, **params):
+    """
+    Synchronous wrapper of 'search_engines': queries 'engines' concurrently
+    and returns their merged results.
+    """
+    import asyncio
+    return asyncio.run(search_engines(filepath, engines, num=num,
+        deadline=deadline, **params))
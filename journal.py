@@ -0,0 +1,89 @@
+# This module implements the journal of a batch run, stored in a single SQLite
+# file. Each file is recorded by the hash of its content and its original path
+# with its state, so that a run which crashed or was killed can be resumed:
+# files already renamed are skipped, names already found are reused and only
+# failures are retried. Copies of a file at other paths have entries of their
+# own, so that they are renamed too.
+
+import time
+import sqlite3
+import threading
+
+from .utils.hashing import file_hash
+
+# States of a file in the journal
+QUEUED = 'queued'       # Found by the watcher, waiting for a worker
+PENDING = 'pending'     # Processing has started
+SEARCHED = 'searched'   # A name has been found but the file is not renamed yet
+RENAMED = 'renamed'     # The file has been renamed
+FAILED = 'failed'       # An error occurred or no name could be found
+
+class Journal():
+    """Journal of the files processed by a batch run.
+
+    Arguments:
+        - path: path to the SQLite file of the journal (created if needed)
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS entries ('
+            'hash TEXT, path TEXT, state TEXT, name TEXT, new_path TEXT, '
+            'error TEXT, updated REAL, PRIMARY KEY (hash, path))')
+        self._db.commit()
+
+    def get(self, filepath, key=None):
+        """
+        Returns the entry of the file at 'filepath' as a dictionary with the
+        keys path, state, name, new_path and error, or None if the file is
+        not in the journal. The entry of a file renamed into 'filepath' comes
+        first. The hash of the file content may be given as 'key'.
+        """
+        key = key or file_hash(filepath)
+        with self._lock:
+            row = self._db.execute('SELECT path, state, name, new_path, error '
+                'FROM entries WHERE hash = ? AND (path = ? OR new_path = ?) '
+                'ORDER BY new_path = ? DESC LIMIT 1',
+                (key, filepath, filepath, filepath)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('path', 'state', 'name', 'new_path', 'error'), row))
+
+    def mark(self, filepath, state, name=None, new_path=None, error=None,
+             key=None):
+        """
+        Records the 'state' of the file at 'filepath' (its path before being
+        renamed). The name found for the file is kept when 'name' is not given.
+        The hash of the file content must be given as 'key' if the file is no
+        longer at 'filepath'.
+        """
+        key = key or file_hash(filepath)
+        with self._lock:
+            self._db.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(hash, path) DO UPDATE SET '
+                'state = excluded.state, '
+                'name = COALESCE(excluded.name, entries.name), '
+                'new_path = excluded.new_path, error = excluded.error, '
+                'updated = excluded.updated',
+                (key, filepath, state, name, new_path,
+                 str(error) if error else None, time.time()))
+            self._db.commit()
+
+    def count(self, state):
+        """Returns the number of files in a given 'state'."""
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM entries WHERE '
+                'state = ?', (state,)).fetchone()[0]
+
+    def paths(self, *states):
+        """Returns the paths of the files in any of the given 'states'."""
+        with self._lock:
+            rows = self._db.execute('SELECT path FROM entries WHERE state IN ('
+                + ', '.join('?' * len(states)) + ') ORDER BY updated',
+                states).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,187 @@
+# This module records the time spent in each stage of the naming pipeline:
+# uploads, page requests, HTML parsing, page title lookups, scoring and
+# renames. For each (stage, engine) pair it keeps a count, a latency histogram
+# and the number of bytes sent and received. Metrics can be exported as a JSON
+# summary or in Prometheus text format, and hooks can subscribe to every
+# measurement.
+
+import json
+import time
+import bisect
+import logging
+import threading
+import contextlib
+
+# Upper bounds of the latency histogram buckets, in seconds
+buckets = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+enabled = True
+
+_stats = {}
+_hooks = []
+_lock = threading.Lock()
+
+class Measure():
+    """Measurement of one stage, passed to the hooks.
+
+    Attributes:
+        - stage: name of the stage (upload, get, parse, title, score, rename)
+        - engine: name of the engine, or None
+        - seconds: duration of the stage
+        - sent, received: number of bytes sent and received
+    """
+    def __init__(self, stage, engine=None):
+        self.stage = stage
+        self.engine = engine
+        self.seconds = 0
+        self.sent = 0
+        self.received = 0
+
+def subscribe(hook):
+    """Calls 'hook' with each Measure once its stage is over."""
+    with _lock:
+        _hooks.append(hook)
+
+def unsubscribe(hook):
+    with _lock:
+        _hooks.remove(hook)
+
+def record(measure):
+    """Adds a Measure to the metrics and passes it to the hooks."""
+    key = (measure.stage, measure.engine)
+    with _lock:
+        if key not in _stats:
+            _stats[key] = {'count': 0, 'seconds': 0.0, 'sent': 0,
+                           'received': 0, 'buckets': [0] * (len(buckets) + 1)}
+        stats = _stats[key]
+        stats['count'] = stats['count'] + 1
+        stats['seconds'] = stats['seconds'] + measure.seconds
+        stats['sent'] = stats['sent'] + measure.sent
+        stats['received'] = stats['received'] + measure.received
+        stats['buckets'][bisect.bisect_left(buckets, measure.seconds)] += 1
+        hooks = list(_hooks)
+    for hook in hooks:
+        try:
+            hook(measure)
+        except Exception as e:
+            logging.warning("Metrics hook: " + str(e))
+
+@contextlib.contextmanager
+def timed(stage, engine=None):
+    """
+    Context manager timing a stage. The Measure is yielded so that the byte
+    counts can be set within the block.
+    """
+    measure = Measure(stage, engine)
+    if not enabled:
+        yield measure
+        return
+    start = time.perf_counter()
+    try:
+        yield measure
+    finally:
+        measure.seconds = time.perf_counter() - start
+        record(measure)
+
+def track(response, measure, streamed=False):
+    """
+    Adds the bytes sent and received by a requests response to a Measure.
+    The body of a streamed response is not read, hence not counted.
+    """
+    body = response.request.body if response.request is not None else None
+    if isinstance(body, (bytes, str)):
+        measure.sent = measure.sent + len(body)
+    if not streamed:
+        measure.received = measure.received + len(response.content or b'')
+    return response
+
+def reset():
+    """Clears all the metrics."""
+    with _lock:
+        _stats.clear()
+
+def snapshot():
+    """
+    Returns a copy of the current metrics, which may be given as 'since' to
+    'summary' or 'export_json' to only report the measurements made after.
+    """
+    with _lock:
+        return {key: dict(stats, buckets=list(stats['buckets']))
+                for key, stats in _stats.items()}
+
+def _difference(stats, before):
+    if before is None:
+        return stats
+    diff = {name: stats[name] - before[name]
+            for name in ('count', 'seconds', 'sent', 'received')}
+    diff['buckets'] = [count - previous for count, previous
+                       in zip(stats['buckets'], before['buckets'])]
+    return diff
+
+def summary(since=None):
+    """
+    Returns the metrics as a dictionary: for each stage, a dictionary of
+    engines ('' when no engine applies) giving count, total and mean seconds,
+    bytes sent and received, and the cumulative latency histogram.
+    Only the measurements made after the 'snapshot' given as 'since' are
+    counted, if any.
+    """
+    out = {}
+    since = since or {}
+    with _lock:
+        for (stage, engine), stats in sorted(_stats.items(),
+                key=lambda item: (item[0][0], item[0][1] or '')):
+            stats = _difference(stats, since.get((stage, engine)))
+            if not stats['count']:
+                continue
+            cumulative = 0
+            histogram = {}
+            for bound, count in zip(buckets + ['+Inf'], stats['buckets']):
+                cumulative = cumulative + count
+                histogram[str(bound)] = cumulative
+            out.setdefault(stage, {})[engine or ''] = {
+                'count': stats['count'],
+                'seconds': stats['seconds'],
+                'mean_seconds': stats['seconds'] / stats['count'],
+                'sent_bytes': stats['sent'],
+                'received_bytes': stats['received'],
+                'histogram': histogram}
+    return out
+
+def export_json(path=None, since=None):
+    """
+    Returns the summary of the metrics as a JSON string, also written to the
+    file at 'path' if given. See 'summary' for 'since'.
+    """
+    text = json.dumps(summary(since), indent=2)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text)
+    return text
+
+def export_prometheus():
+    """Returns the metrics in Prometheus text exposition format."""
+    lines = ['# HELP imgnamer_stage_seconds Time spent in each stage.',
+             '# TYPE imgnamer_stage_seconds histogram']
+    bytes_lines = []
+    for stage, engines in summary().items():
+        for engine, stats in engines.items():
+            labels = 'stage="' + stage + '",engine="' + engine + '"'
+            for bound, count in stats['histogram'].items():
+                lines.append('imgnamer_stage_seconds_bucket{' + labels
+                    + ',le="' + bound + '"} ' + str(count))
+            lines.append('imgnamer_stage_seconds_sum{' + labels + '} '
+                + repr(stats['seconds']))
+            lines.append('imgnamer_stage_seconds_count{' + labels + '} '
+                + str(stats['count']))
+            for direction in ('sent', 'received'):
+                bytes_lines.append('imgnamer_' + direction + '_bytes_total{'
+                    + labels + '} ' + str(stats[direction + '_bytes']))
+    lines.append('# HELP imgnamer_sent_bytes_total Bytes sent to the engines.')
+    lines.append('# TYPE imgnamer_sent_bytes_total counter')
+    lines.extend(line for line in bytes_lines if '_sent_' in line)
+    lines.append('# HELP imgnamer_received_bytes_total Bytes received from '
+                 'the engines.')
+    lines.append('# TYPE imgnamer_received_bytes_total counter')
+    lines.extend(line for line in bytes_lines if '_received_' in line)
+    return '\n'.join(lines) + '\n'
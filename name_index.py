@@ -0,0 +1,122 @@
+# This module implements a persistent index of the names given to images,
+# stored in a single SQLite file. Each entry records the perceptual hash of an
+# image, the name it received and the location the name comes from, so that a
+# new image close enough to one already named can be named offline.
+#
+# Lookups use multi-index hashing: hashes are split into 'parts' chunks, each
+# one stored in an indexed column. Two hashes within a distance d have at least
+# one chunk within a distance d // parts, so only the entries sharing such a
+# chunk are compared, whatever the size of the index.
+
+import sqlite3
+import logging
+import threading
+import itertools
+
+from .utils.paths import data_path
+from .utils.phash import dhash, hamming, split_hash, hash_bits
+
+# Index settings
+path = None             # Path of the SQLite file (default: data directory)
+max_distance = 3        # Maximum Hamming distance of a match
+enabled = True          # When False, the index is neither read nor written
+parts = 4               # Number of chunks (fixed once the index is created)
+
+_connection = None
+_lock = threading.Lock()
+
+def configure(**settings):
+    """
+    Changes the index settings: path, max_distance, enabled.
+    Changing the path closes the current database.
+    """
+    global _connection
+    with _lock:
+        for name, value in settings.items():
+            if name not in ('path', 'max_distance', 'enabled'):
+                raise TypeError("Unknown index setting '" + name + "'")
+            globals()[name] = value
+        if 'path' in settings and _connection:
+            _connection.close()
+            _connection = None
+
+def _db():
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(path or data_path('names.sqlite'),
+            check_same_thread=False)
+        columns = ', '.join('c' + str(i) + ' INTEGER' for i in range(parts))
+        _connection.execute('CREATE TABLE IF NOT EXISTS names (phash TEXT, '
+            'name TEXT, location TEXT, ' + columns + ')')
+        for i in range(parts):
+            _connection.execute('CREATE INDEX IF NOT EXISTS names_c' + str(i)
+                + ' ON names (c' + str(i) + ')')
+        _connection.commit()
+    return _connection
+
+def _neighbours(chunk, size, radius):
+    """Returns all the values within 'radius' bits of a chunk of 'size' bits."""
+    values = [chunk]
+    for r in range(1, radius + 1):
+        for bits in itertools.combinations(range(size), r):
+            value = chunk
+            for bit in bits:
+                value = value ^ (1 << bit)
+            values.append(value)
+    return values
+
+def record(filepath, name, location=None):
+    """
+    Records the 'name' given to the image at 'filepath', and the 'location' it
+    comes from. Nothing is recorded if the image cannot be hashed.
+    """
+    if not enabled:
+        return
+    try:
+        value = dhash(filepath)
+    except Exception as e:
+        logging.debug("Name index: " + str(e))
+        return
+    try:
+        with _lock:
+            db = _db()
+            db.execute('INSERT INTO names VALUES (?, ?, ?, '
+                + ', '.join('?' * parts) + ')',
+                [format(value, 'x'), name, location] + split_hash(value, parts))
+            db.commit()
+    except sqlite3.Error as e:
+        logging.warning("Name index: " + str(e))
+
+def lookup(filepath):
+    """
+    Returns the (name, location, distance) of the closest image recorded within
+    'max_distance' of the image at 'filepath', or None if there is none.
+    """
+    if not enabled:
+        return None
+    try:
+        value = dhash(filepath)
+    except Exception as e:
+        logging.debug("Name index: " + str(e))
+        return None
+
+    radius = max_distance // parts
+    best = None
+    try:
+        with _lock:
+            db = _db()
+            for i, chunk in enumerate(split_hash(value, parts)):
+                size = hash_bits // parts + (1 if i < hash_bits % parts else 0)
+                values = _neighbours(chunk, size, radius)
+                rows = db.execute('SELECT phash, name, location FROM names '
+                    'WHERE c' + str(i) + ' IN (' + ', '.join('?' * len(values))
+                    + ')', values)
+                for phash, name, location in rows:
+                    distance = hamming(value, int(phash, 16))
+                    if distance <= max_distance and (best is None
+                            or distance < best[2]):
+                        best = (name, location, distance)
+    except sqlite3.Error as e:
+        logging.warning("Name index: " + str(e))
+        return None
+    return best
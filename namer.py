@@ -1,19 +1,19 @@
 import logging
-import operator
-
-import requests
-import bs4
+import itertools
 
+from . import cache, metrics
 from .search import SearchResult
-from .search.google import fetch_url
-from .img_search import search
-from .relevance import score
+from .img_search import engine_slot, iter_search
 
-__all__ = ['suggested_name', 'best_guess']
+__all__ = ['suggested_name', 'best_guess', 'rank', 'cascade']
 
 # Compatible User Agent for Google search
 user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:54.0) Gecko/20100101 Firefox/54.0'
 
+# Settings of the engine cascade (see 'cascade')
+confidence = 1.5        # Relevance score of a result good enough to stop
+min_agreement = 0.5     # Fraction of the hint words its title must contain
+
 def prettify(name):
     new_name = name.title()  # titlecase name
     return new_name
@@ -34,36 +34,133 @@ def best_guess(filepath):
     """"
     Returns Google's best guess for an image specified by its location.
     If no suggestion can be found, an empty string is returned.
+    The guess is read from the search cache when available.
     """
-    fetchUrl = fetch_url(filepath)
+    hint = cache.get_hint(filepath)
+    if hint is not None:
+        return hint
+    with engine_slot('GOOGLE'):
+        return _best_guess(filepath)
+
+def _best_guess(filepath):
+    # The results page is shared with the Google engines (see ResultsPage)
+    from .search.google import results_page
+    try:
+        page = results_page(filepath)
+    except Exception as e:
+        logging.warning(str(e))
+        return ''
 
-    if (fetchUrl):
+    if (page):
         try:
-            response = requests.get(fetchUrl,
-                headers={'User-Agent': user_agent})
-            soup = bs4.BeautifulSoup(response.content, "html.parser")
-            # get the tag containing Google's suggested search
-            suggestion = soup.find("a", class_="_gUb")
-            return prettify(suggestion.string)
+            # get Google's suggested search
+            hint = prettify(page.best_guess())
         except Exception as e:
             logging.warning(str(e))
-            return ''
+            hint = ''
+        cache.put_hint(filepath, hint)
+        return hint
     else:
         return ''
 
+def rank(results, original_file=None, hint=''):
+    """
+    Returns the complete ranking of a list of results, best first, as a list of
+    (result, breakdown) pairs. The breakdown is a dictionary giving the factors
+    of the score ('pattern', 'hint', 'dimensions'), the positional malus
+    ('position') and the final 'score'.
+    Results with the same final score keep their original order.
+    """
+    from .relevance import score_batch
+    with metrics.timed('score'):
+        factors = score_batch(results, original_file=original_file, hint=hint)
+    ranked = []
+    for i, res in enumerate(results):
+        breakdown = {name: float(values[i]) for name, values in factors.items()}
+        breakdown['position'] = - i / 10    # include a positional malus
+        breakdown['score'] = breakdown['score'] + breakdown['position']
+        ranked.append((res, breakdown))
+    ranked.sort(key=lambda item: item[1]['score'], reverse=True)
+    return ranked
+
 def choose_best(results, original_file=None, hint=''):
     """
     Determine the best name from a list of results.
+    An empty string is returned if there is no result.
     """
-    # Rank results by score with a dictionary
-    ranked = dict()
-    for i, res in enumerate(results):
-        s = score(res, original_file=original_file, hint=hint)
-        s = s - i / 10  # include a positional malus
-        if s not in ranked:
-            ranked[s] = []
-        ranked[s].append(res)
-    # Return the first of the best ranked results
-    ranked = sorted(ranked.items(), key=operator.itemgetter(0))
-    top_list = list(ranked)[-1][1]
-    return top_list[0].title
+    ranked = rank(results, original_file=original_file, hint=hint)
+    if not ranked:
+        return ''
+    return ranked[0][0].title
+
+def is_confident(result, original_file=None, hint=''):
+    """
+    Tells whether a result is good enough to stop searching: its relevance
+    score reaches 'confidence' and, when there is a hint, its title contains
+    at least 'min_agreement' of the hint words.
+    """
+    from .relevance import score, hint_words, hint_bonus
+    if score(result, original_file=original_file, hint=hint) < confidence:
+        return False
+    if not hint_words(hint, min_size=2):
+        return True
+    return hint_bonus(result.title, hint, min_size=2) - 1 >= min_agreement
+
+def cascade(filepath, engines, hint='', num=5, **params):
+    """
+    Queries the engines one after the other, in preferred order, until a
+    result is confident enough (see 'is_confident'). The following pages and
+    the lower-priority engines are then not queried.
+
+    Arguments:
+        - filepath: the path to the image file to search
+        - engines: a list of engines, listed in preferred order
+    Optional:
+        - hint: the best guess for the image
+        - num: Maximum number of search results per engine (default = 5)
+        - params: a dictionary of search GET parameters
+
+    Returns the ranking of the results gathered (see 'rank') and a dictionary
+    giving the engine which decided ('decided_by', None if no result was
+    confident enough) and the number of engines queried ('engine_calls').
+    """
+    results = []
+    decided_by = None
+    calls = 0
+    # Results cut short by a confident one are cached under the settings
+    # which made it confident, so that a rerun stops at the same place
+    stop = [confidence, min_agreement, hint]
+    for engine in engines or []:
+        calls = calls + 1
+        cached = cache.get_results(filepath, engine, num, params)
+        if cached is None:
+            cached = cache.get_results(filepath, engine, num, params, stop)
+        if cached is not None:
+            for res in cached:
+                res.engine = engine
+            stream = iter(cached)
+        else:
+            stream = iter_search(filepath, engine, num=num, **params)
+        gathered = []
+        complete = False
+        try:
+            for res in itertools.islice(stream, num):
+                gathered.append(res)
+                if is_confident(res, original_file=filepath, hint=hint):
+                    decided_by = engine
+                    break
+            complete = True
+        except Exception as e:
+            logging.error(engine + ": " + str(e))
+        finally:
+            if cached is None:
+                stream.close()
+        # Results cut short by an error are used but not cached
+        if cached is None and gathered and complete:
+            cache.put_results(filepath, engine, num, params, gathered,
+                              stop if decided_by else None)
+        results.extend(gathered)
+        if decided_by:
+            break
+    return rank(results, filepath, hint=hint), {'decided_by': decided_by,
+                                                'engine_calls': calls}
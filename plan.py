@@ -0,0 +1,156 @@
+# Two-phase renaming. The slow network phase writes a rename plan, one JSON
+# object per line, without touching the files:
+#   {"path": ..., "hash": ..., "name": ..., "method": ..., "engine": ...,
+#    "location": ..., "score": {...}}
+# The plan can be reviewed or edited, then applied later, possibly on another
+# machine, by a fast filesystem phase which keeps an undo log of the renames.
+
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import rename, file_hash
+from .utils.rename import move
+from .utils.walk import walk_files
+from .utils.pool import bounded_map
+
+def img_plan(folder_path, plan_file, sub_folders=False, method='BEST_GUESS',
+             engines=None, workers=1, deadline=None, **filters):
+    """
+    Searches names for the images in a folder and writes the rename plan to
+    'plan_file' as they are found, replacing any previous plan. No file is
+    renamed.
+    Arguments are those of 'img_batch_rename'.
+
+    Returns the number of entries written to the plan.
+    """
+    from .core import find_name, supported_ext
+
+    lock = threading.Lock()
+    def task(path):
+        try:
+            name, details = find_name(path, method=method, engines=engines,
+                                      deadline=deadline)
+            entry = {'path': os.path.abspath(path), 'hash': file_hash(path),
+                     'name': name}
+            entry.update(details)
+        except Exception as e:
+            logging.error(os.path.basename(path) + ': ' + str(e))
+            return 0
+        if not name:
+            return 0
+        with lock:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+        return 1
+
+    files = walk_files(folder_path, sub_folders=sub_folders,
+                       extensions=supported_ext, **filters)
+    with open(plan_file, 'w', encoding='utf-8') as f:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            return sum(bounded_map(executor, task, files, 2 * max(1, workers)))
+
+def read_plan(plan_file):
+    """Generates the entries of a rename plan."""
+    with open(plan_file, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def apply_plan(plan_file, undo_file=None, verify=True, rollback=True):
+    """
+    Renames the files listed in a rename plan. Existing files are never
+    overwritten: a numbered suffix is added instead. Each rename is appended to
+    'undo_file' (default: plan_file + '.undo') as soon as it is done.
+
+    Arguments:
+    - plan_file: path to the rename plan.
+    - undo_file: (optional) path to the undo log.
+    - verify: when True, files whose content hash differs from the plan are
+    skipped.
+    - rollback: when True, the renames already done are reverted if one of
+    them fails, and the error is raised again.
+
+    Returns the list of (old path, new path) pairs of the renamed files.
+    """
+    undo_file = undo_file or plan_file + '.undo'
+    done = []
+    with open(undo_file, 'a', encoding='utf-8') as undo_log:
+        for entry in read_plan(plan_file):
+            path = entry['path']
+            try:
+                if not os.path.isfile(path):
+                    logging.warning(path + ' no longer exists')
+                    continue
+                if verify and file_hash(path) != entry['hash']:
+                    logging.warning(path + ' changed since the plan was made')
+                    continue
+                new_path = rename(path, entry['name'])
+            except Exception as e:
+                logging.error(os.path.basename(path) + ': ' + str(e))
+                if rollback:
+                    failed = undo_renames(done)
+                    undo_log.write(json.dumps({'rollback': len(done)}) + '\n')
+                    # Files not restored can still be restored with 'undo'
+                    for old, new in failed:
+                        undo_log.write(json.dumps({'from': new, 'to': old})
+                                       + '\n')
+                    logging.error(str(len(done) - len(failed))
+                        + ' renames rolled back' + (', ' + str(len(failed))
+                        + ' left in ' + undo_file if failed else ''))
+                    raise
+                continue
+            if new_path and new_path != path:
+                done.append((path, new_path))
+                undo_log.write(json.dumps({'from': new_path, 'to': path})
+                               + '\n')
+                undo_log.flush()
+    return done
+
+def undo_renames(renames):
+    """
+    Reverts a list of (old path, new path) renames, the last one first. A file
+    is not restored if another file now exists at its old path.
+    Returns the list of the renames which could not be reverted, in order.
+    """
+    failed = []
+    for old, new in reversed(renames):
+        try:
+            move(new, old)
+        except FileExistsError:
+            logging.error("Couldn't restore " + old + ': another file exists '
+                          'at this path')
+            failed.insert(0, (old, new))
+        except OSError as e:
+            logging.error("Couldn't restore " + old + ': ' + str(e))
+            failed.insert(0, (old, new))
+    return failed
+
+def undo(undo_file):
+    """
+    Reverts the renames recorded in an undo log, the last one first.
+    Renames already reverted by a rollback are skipped. The log is removed
+    once all the files are restored; otherwise it is rewritten with the
+    renames which could not be reverted, so that 'undo' can be run again.
+    Returns the number of files restored.
+    """
+    renames = []
+    with open(undo_file, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if 'rollback' in record:
+                renames = renames[:len(renames) - record['rollback']]
+            else:
+                renames.append((record['to'], record['from']))
+    failed = undo_renames(renames)
+    if not failed:
+        os.remove(undo_file)
+        return len(renames)
+    tmp_file = undo_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        for old, new in failed:
+            f.write(json.dumps({'from': new, 'to': old}) + '\n')
+    os.replace(tmp_file, undo_file)
+    return len(renames) - len(failed)
@@ -2,11 +2,20 @@
 # relevance of search results, thus helping naming functions to determine the
 # best match when naming a picture.
 
+import os
 import re
 import json
 import math
+import time
+import threading
+import functools
 from urllib.parse import urlparse
 
+try:
+    import numpy as np
+except ImportError:     # Batch scoring falls back to pure Python
+    np = None
+
 from .utils import get_image_size
 from .search import SearchResult
 
@@ -19,7 +28,19 @@ from .search import SearchResult
 #   avoid    -> List of words that negatively impacts results
 # YOU can use '%s' in patterns to refer to a website's name
 
-patterns_file = 'patterns.json'
+patterns_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'patterns.json')
+
+# Bonus applied for each category of patterns
+pattern_values = [('specific', 2), ('generic', 1.5), ('avoid', 0.5)]
+
+# Minimum delay in seconds between two checks of the patterns file's mtime
+reload_interval = 1.0
+
+_patterns = None        # Patterns loaded from 'patterns_file'
+_patterns_mtime = None
+_patterns_checked = 0
+_patterns_lock = threading.Lock()
 
 # Implementation of a 2D Vector
 class Vector():
@@ -48,6 +69,22 @@ def dimensions_similarity(dim1, dim2):
     normal_diff = diff / max(u.norm(), v.norm())
     return(1 - normal_diff)
 
+@functools.lru_cache(maxsize=4096)
+def site_name(location):
+    """
+    Returns the name of the website at 'location', e.g. 'deviantart' for
+    'https://www.deviantart.com/art/...'.
+    """
+    if location[:4] == 'http':
+        site = urlparse(location).hostname
+    else:
+        site = urlparse('http://' + location).hostname
+    site = site.split('.')
+    if (site[0] == 'www'):
+        return site[1]
+    else:
+        return site[0]
+
 def build_pattern(expr, location):
     """
     Returns a pattern obtained by replacing the placeholder of an expression
@@ -60,16 +97,7 @@ def build_pattern(expr, location):
     if (expr.find('%s') == -1):
         return expr
     else:
-        if location[:4] == 'http':
-            site = urlparse(location).hostname
-        else:
-            site = urlparse('http://' + location).hostname
-        site = site.split('.')
-        if (site[0] == 'www'):
-            site = site[1]
-        else:
-            site = site[0]
-        return expr % site
+        return expr % site_name(location)
 
 def apply_bonus(value, title, pattern_list):
     """
@@ -81,21 +109,74 @@ def apply_bonus(value, title, pattern_list):
     # Default value on loop end if no value has been returned beforehand
     return 1
 
+def load_patterns():
+    """
+    Returns the patterns of 'patterns_file' as a dictionary of lists.
+    The file is only read again when its modification time changes.
+    """
+    global _patterns, _patterns_mtime, _patterns_checked
+    now = time.monotonic()
+    if _patterns is not None and now - _patterns_checked < reload_interval:
+        return _patterns
+    with _patterns_lock:
+        mtime = os.stat(patterns_file).st_mtime_ns
+        if _patterns is None or mtime != _patterns_mtime:
+            with open(patterns_file, 'r') as f:
+                data = json.loads(f.read())
+            data['_placeholder'] = any('%s' in e
+                for category, value in pattern_values for e in data[category])
+            _patterns, _patterns_mtime = data, mtime
+            compiled_patterns.cache_clear()
+            title_bonus.cache_clear()
+        _patterns_checked = now
+        return _patterns
+
+@functools.lru_cache(maxsize=1024)
+def compiled_patterns(site):
+    """
+    Returns a list of (bonus value, compiled regex) pairs, one per category of
+    patterns, where the placeholders are replaced by 'site'. All the patterns of
+    a category are combined in a single alternation.
+    """
+    data = _patterns
+    out = []
+    for category, value in pattern_values:
+        exprs = [e % site if '%s' in e else e for e in data[category]]
+        if exprs:
+            regex = '|'.join('(?:' + e + ')' for e in exprs)
+            out.append((value, re.compile(regex, re.IGNORECASE)))
+    return out
+
+@functools.lru_cache(maxsize=4096)
+def title_bonus(title, site):
+    """
+    Returns the bonus factor of the patterns matched by 'title', where the
+    placeholders are replaced by 'site'. Titles found by several engines, or
+    searched again, are only matched once.
+    """
+    val = 1
+    for value, regex in compiled_patterns(site):
+        if regex.search(title):
+            val = val * value
+    return val
+
 def pattern_bonus(title, location):
     """
     Returns a multiplicative bonus factor when a result's 'title' matches one
     of the patterns contained in 'patterns_file' file.
     """
-    val = 1
-    with open(patterns_file, 'r') as f:
-        data = json.loads(f.read())
-        val = val * apply_bonus(2, title,
-            [build_pattern(e, location) for e in data['specific']])
-        val = val * apply_bonus(1.5, title,
-            [build_pattern(e, location) for e in data['generic']])
-        val = val * apply_bonus(0.5, title,
-            [build_pattern(e, location) for e in data['avoid']])
-        return val
+    data = load_patterns()
+    # The site name is only needed by patterns with a placeholder
+    site = None
+    if data['_placeholder']:
+        site = site_name(location)
+    return title_bonus(title, site)
+
+def hint_words(hint, min_size=1):
+    """
+    Returns the lowercase words of 'hint' that are at least 'min_size' long.
+    """
+    return [word.lower() for word in hint.split(' ') if len(word) >= min_size]
 
 def hint_bonus(title, hint, min_size=1):
     """
@@ -104,19 +185,18 @@ def hint_bonus(title, hint, min_size=1):
     The optional 'min_size' allows the user to filter out words shorter than it.
     """
     # Convert the hint in a list of words (> min_size)
-    hint_words = hint.split(' ')
-    for word in hint_words:
-        if len(word) < min_size:
-            hint_words.remove(word)
+    words = hint_words(hint, min_size)
+    if not words:
+        return 1
 
     # Count how many of the words appear in the title
     count = 0
-    for word in hint_words:
+    for word in words:
         # Match only words in the title
         # (we do not use 'find' function that may match sub-words too)
-        if word.lower() in title.lower():
+        if word in title.lower():
              count = count + 1
-    return (1 + count/len(hint_words))
+    return (1 + count/len(words))
 
 def score(result, original_file=None, hint=''):
     score = pattern_bonus(result.title, result.location)
@@ -125,3 +205,69 @@ def score(result, original_file=None, hint=''):
         score = score * dimensions_similarity(result.dimensions,
                                               get_image_size(original_file))
     return score
+
+def score_batch(results, original_file=None, hint=''):
+    """
+    Scores a whole list of results at once and returns a dictionary of
+    per-factor scores, each one being a sequence aligned with 'results':
+    - pattern: bonus of the patterns matched by the title
+    - hint: bonus of the hint words found in the title
+    - dimensions: similarity with the dimensions of the original file
+    - score: product of the three factors, as returned by 'score'
+
+    'original_file' and 'hint' may also be lists giving one value per result,
+    so that the results of several images can be scored in a single pass.
+    Sequences are NumPy arrays when NumPy is available, lists otherwise.
+
+    Patterns are matched once per distinct (title, site) pair. With NumPy,
+    the hint words are looked up as a (results x words) matrix per distinct
+    hint and the dimensions are compared as arrays.
+    """
+    n = len(results)
+    files = original_file if isinstance(original_file, list) \
+        else [original_file] * n
+    hints = hint if isinstance(hint, list) else [hint] * n
+
+    data = load_patterns()
+    sites = [site_name(res.location) if data['_placeholder'] else None
+             for res in results]
+    patterns = [title_bonus(res.title, site)
+                for res, site in zip(results, sites)]
+
+    # Hint words are computed once per distinct hint
+    words = {h: hint_words(h, min_size=2) for h in set(hints)}
+
+    # Results without an original file get a neutral similarity
+    found = [(res.dimensions, get_image_size(f))
+             for res, f in zip(results, files) if f]
+    if np is not None:
+        patterns = np.array(patterns, dtype=float)
+        titles = np.array([res.title.lower() for res in results], dtype=str)
+        rows = np.array(hints, dtype=object)
+        hints = np.ones(n)
+        for h, hint_list in words.items():
+            if not hint_list:
+                continue
+            mask = rows == h
+            found_words = np.char.find(titles[mask][:, None],
+                np.array(hint_list, dtype=str)[None, :]) >= 0
+            hints[mask] = 1 + found_words.mean(axis=1)
+        dimensions = np.ones(n)
+        if found:
+            mask = np.array([bool(f) for f in files])
+            u = np.array([d for d, o in found], dtype=float)
+            v = np.array([o for d, o in found], dtype=float)
+            diff = np.linalg.norm(u - v, axis=1)
+            dimensions[mask] = 1 - diff / np.maximum(
+                np.linalg.norm(u, axis=1), np.linalg.norm(v, axis=1))
+        total = patterns * hints * dimensions
+    else:
+        hints = [1 + sum(w in res.title.lower() for w in words[h])
+                 / len(words[h]) if words[h] else 1
+                 for res, h in zip(results, hints)]
+        similarities = iter([dimensions_similarity(d, o) for d, o in found])
+        dimensions = [next(similarities) if f else 1 for f in files]
+        total = [p * h * d for p, h, d in zip(patterns, hints, dimensions)]
+
+    return {'pattern': patterns, 'hint': hints, 'dimensions': dimensions,
+            'score': total}
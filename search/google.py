@@ -1,27 +1,165 @@
 import os
 import logging
 import re
-
-import requests
-import bs4
+import threading
+import itertools
+import contextlib
+from collections import OrderedDict
+from urllib.parse import urljoin
 
 from .result import SearchResult
+from . import transport
+from .parsing import parse
+from .utils import query_string, PagePrefetcher
+from .upload import query_image
+from ..utils.hashing import file_hash
 
 # Global variables for Google search
 user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:54.0) Gecko/20100101 Firefox/54.0'
 baseUrl = 'https://encrypted.google.com/searchbyimage/upload'
 
+# Search sessions: URL of the results page obtained by uploading an image, keyed
+# by the hash of the image content so that each image is uploaded only once.
+max_sessions = 1024
+_sessions = OrderedDict()
+_sessions_guard = threading.Lock()
+_upload_locks = {}
+
+# First results pages of the search sessions, keyed like the sessions. Each
+# page is fetched and parsed once, then shared by the best guess, the results
+# of page 1 and the Google Images search (see 'ResultsPage').
+max_pages = 256
+_pages = OrderedDict()
+_page_locks = {}
+
+class ResultsPage():
+    """First page of Google results for an image. The blocks used by the best
+    guess, the results and the link to all sizes are kept in a single tree.
+
+    Arguments:
+        - url: URL of the results page
+        - content: HTML of the results page
+    """
+    def __init__(self, url, content):
+        self.url = url
+        self.soup = parse(content, 'GOOGLE_PAGE')
+        self._results = None
+        self._lock = threading.Lock()
+
+    def best_guess(self):
+        """Returns Google's best guess for the image, or an empty string."""
+        suggestion = self.soup.find('a', class_='_gUb')
+        return suggestion.string or '' if suggestion else ''
+
+    def all_sizes_url(self):
+        """Returns the URL of the page of all sizes of the image, or None."""
+        blocks = self.soup.select('._v6')
+        links = blocks[0].select('.gl') if blocks else []
+        if links:
+            # Links are relative to the results page
+            return urljoin(self.url, links[0].a['href'])
+        return None
+
+    def results(self):
+        """Returns the list of SearchResult objects of the page."""
+        with self._lock:
+            if self._results is None:
+                self._results = page_results(self.soup)
+            return self._results
+
 def fetch_url(filepath):
     """
     Returns the URL containing Google search results for an image.
+    The image is uploaded on the first call only; later calls for the same
+    content reuse the URL of the search session.
+
+    Arguments:
+        - filepath: the path to the image file to search
+    """
+    try:
+        key = file_hash(filepath)
+    except OSError as e:
+        logging.error(str(e))
+        return None
+
+    with _sessions_guard:
+        if key in _sessions:
+            _sessions.move_to_end(key)
+            return _sessions[key]
+        lock = _upload_locks.setdefault(key, threading.Lock())
+
+    # Concurrent callers for the same image wait for a single upload
+    with lock:
+        with _sessions_guard:
+            if key in _sessions:
+                return _sessions[key]
+        location = upload(filepath)
+        with _sessions_guard:
+            if location:
+                _sessions[key] = location
+                if len(_sessions) > max_sessions:
+                    _sessions.popitem(last=False)
+            _upload_locks.pop(key, None)
+    return location
+
+def end_session(filepath):
+    """
+    Forgets the search session of an image, forcing a new upload next time.
+    """
+    with _sessions_guard:
+        _sessions.pop(file_hash(filepath), None)
+        _pages.pop(file_hash(filepath), None)
+
+def results_page(filepath):
+    """
+    Returns the ResultsPage of an image, or None if the image could not be
+    uploaded. The page is fetched on the first call only. Network errors are
+    raised.
+
+    Arguments:
+        - filepath: the path to the image file to search
+    """
+    key = file_hash(filepath)
+    with _sessions_guard:
+        if key in _pages:
+            _pages.move_to_end(key)
+            return _pages[key]
+        lock = _page_locks.setdefault(key, threading.Lock())
+
+    # Concurrent callers for the same image wait for a single fetch
+    with lock:
+        with _sessions_guard:
+            if key in _pages:
+                return _pages[key]
+        try:
+            url = fetch_url(filepath)
+            if not url:
+                return None
+            response = transport.get(url, engine='GOOGLE',
+                headers={'User-Agent': user_agent})
+            page = ResultsPage(url, response.content)
+            with _sessions_guard:
+                _pages[key] = page
+                if len(_pages) > max_pages:
+                    _pages.popitem(last=False)
+        finally:
+            with _sessions_guard:
+                _page_locks.pop(key, None)
+    return page
+
+def upload(filepath):
+    """
+    Uploads an image to Google reverse image search and returns the URL of the
+    results page. Large images are replaced by a reduced query image.
 
     Arguments:
         - filepath: the path to the image file to search
     """
     try:
-        with open(filepath, 'rb') as f:
-            multipart = {'encoded_image': (filepath, f), 'image_content': ''}
-            response = requests.post(baseUrl,
+        query = query_image(filepath)
+        with open(query, 'rb') as f:
+            multipart = {'encoded_image': (query, f), 'image_content': ''}
+            response = transport.post(baseUrl, engine='GOOGLE',
                 files=multipart,
                 allow_redirects=False)
             return response.headers['Location']
@@ -29,9 +167,82 @@ def fetch_url(filepath):
         logging.error(str(e))
         return None
 
+def page_results(soup):
+    """
+    Returns the list of SearchResult objects of a parsed results page.
+    The tree is only read, so that it may be shared by several threads.
+    """
+    # extract results from the "Pages that include matching images" block
+    result_block = soup.select('._NId')
+    if len(result_block) == 0:
+        return []  # We may have reached the end of results
+    results = []
+    for res in result_block[-1].select(".rc"):
+        snippet = res.select(".st")[0]
+        block = snippet.select(".f")[0]
+        dimensions = re.findall(r"(\d+) × (\d+)", block.get_text())[0]
+        # The description is the snippet without its dimensions block
+        skipped = set(id(string) for string in block.strings)
+        description = ''.join(string for string in snippet.strings
+                              if id(string) not in skipped)
+
+        results.append(SearchResult(
+            dimensions,
+            res.find_all("h3", class_="r")[0].string,
+            res.find_all("cite", class_="_Rm")[0].string,
+            description))
+    return results
+
+def iter_results(filepath, num=None, **search_params):
+    """
+    Generates the SearchResult objects obtained with Google Images, page after
+    page. Once the consumer has pulled half of a page, the next page is fetched
+    in the background if the consumer needs more results than the page holds.
+    The first page is shared with the best guess (see 'ResultsPage') when no
+    search parameter is given. Network errors are raised, so that consumers
+    can tell a search cut short from a complete one.
+
+    Arguments:
+        - filepath: the path to the image file to search
+    Optional:
+        - num: Maximum number of results the consumer takes (default: all)
+        - params: a dictionary of search GET parameters
+    """
+    searchUrl = fetch_url(filepath)
+    if not searchUrl:
+        return
+    params = query_string(search_params)
+
+    def fetch(page):
+        if page == 1 and not params:
+            first = results_page(filepath)
+            if first:
+                return first.results()
+        response = transport.get(
+            searchUrl + '&start=' + str((page-1)*10) + params,
+            engine='GOOGLE', headers={'User-Agent': user_agent})
+        return page_results(parse(response.content, 'GOOGLE'))
+
+    pages = PagePrefetcher(fetch, needed=num)
+    try:
+        while True:
+            # Get the results of the page
+            results = pages.get()
+            if len(results) == 0:
+                return
+            for i, res in enumerate(results):
+                if i >= len(results) // 2:
+                    pages.prefetch(left=len(results) - i)
+                pages.taken()
+                yield res
+            pages.advance()
+    finally:
+        pages.close()
+
 def search(filepath, num=5, **search_params):
     """
     Returns a list of SearchResult objects obtained with Google Images.
+    Pages are only fetched until 'num' results have been gathered.
 
     Arguments:
         - filepath: the path to the image file to search
@@ -39,41 +250,13 @@ def search(filepath, num=5, **search_params):
         - num: Maximum number of search results to return (default = 5)
         - params: a dictionary of search GET parameters
     """
-    searchUrl = fetch_url(filepath)
-    out=[]      # Output list of SearchResult objects
-    page = 1    # Results page
-    params = '' # String containing specific search GET parameters
-    for p, val in search_params:
-        params = params + '&' + p + '=' + val
-
-    while(len(out) < num):
-        # Get results page
+    results = []
+    with contextlib.closing(iter_results(filepath, num=num,
+                                         **search_params)) as stream:
         try:
-            response = requests.get(
-                searchUrl + '&start=' + str((page-1)*10) + params,
-                headers={'User-Agent': user_agent})
+            for res in itertools.islice(stream, num):
+                results.append(res)
         except Exception as e:
+            # The results gathered before the error are returned
             logging.error(str(e))
-            return out
-
-        soup = bs4.BeautifulSoup(response.content, "html.parser")
-        # extract results from the "Pages that include matching images" block
-        result_block = soup.select('._NId')
-        if len(result_block) > 0:
-            results = result_block[-1].select(".rc")
-            for res in results:
-                snippet = res.select(".st")[0]
-                dimensions = snippet.select(".f")[0].extract()
-                dimensions = re.findall(r"(\d+) × (\d+)", dimensions.string)[0]
-
-                out.append(SearchResult(
-                    dimensions,
-                    res.find_all("h3", class_="r")[0].string,
-                    res.find_all("cite", class_="_Rm")[0].string,
-                    snippet.text))
-                # No need to continue if enough results have been gathered
-                if (len(out) >= num): break
-            page = page + 1
-        else:   # We may have reached the end of results
-            break
-    return out
+    return results
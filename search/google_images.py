@@ -7,12 +7,14 @@ import os
 import logging
 import re
 import json
-
-import requests
-import bs4
+import itertools
+import contextlib
 
 from .result import SearchResult
+from . import transport
+from .parsing import parse
 from . import google
+from .utils import query_string
 
 # Global variables for Google search
 user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:54.0) Gecko/20100101 Firefox/54.0'
@@ -26,49 +28,39 @@ def fetch_url(filepath):
     Arguments:
         - filepath: the path to the image file to search
     """
-    main_url = google.fetch_url(filepath)
+    # The main results page is shared with the google module
     try:
-        response = requests.get(main_url, headers={'User-Agent': user_agent})
+        page = google.results_page(filepath)
     except Exception as e:
         logging.error(str(e))
         return None
+    return page.all_sizes_url() if page else None
 
-    soup = bs4.BeautifulSoup(response.content, "html.parser")
-    base = 'https://encrypted.google.com'
-    if soup.find_all('div', class_='_v6'):
-        if soup.select('._v6')[0].select('.gl'):
-            return base + soup.select('._v6')[0].select('.gl')[0].a['href']
-
-def search(filepath, num=5, **search_params):
+def iter_results(filepath, num=None, **search_params):
     """
-    Returns a list of SearchResult objects obtained with Google Images.
+    Generates the SearchResult objects obtained with Google Images (page with
+    all sizes available). There is a single page, so 'num' (the maximum
+    number of results the consumer takes) changes nothing. Network errors are
+    raised, so that consumers can tell a search cut short from a complete one.
 
     Arguments:
         - filepath: the path to the image file to search
     Optional:
-        - num: Maximum number of search results to return (default = 5)
+        - num: Maximum number of results the consumer takes (default: all)
         - params: a dictionary of search GET parameters
     """
     searchUrl = fetch_url(filepath)
-    out=[]      # Output list of SearchResult objects
-    page = 1    # Results page
-    params = '' # String containing specific search GET parameters
-    for p, val in search_params:
-        params = params + '&' + p + '=' + val
+    params = query_string(search_params)
 
     # Get image results page
     if searchUrl:
-        try:
-            response = requests.get(searchUrl + params,
-                headers={'User-Agent': user_agent})
-        except Exception as e:
-            logging.error(str(e))
-            return out
+        response = transport.get(searchUrl + params,
+            engine='GOOGLE_IMAGES', headers={'User-Agent': user_agent})
     else:
         logging.warning("No image results for " + os.path.basename(filepath))
-        return out
+        return
 
-    soup = bs4.BeautifulSoup(response.content, "html.parser")
+    soup = parse(response.content, 'GOOGLE_IMAGES')
     results = soup.select('.rg_bx')
 
     for res in results:
@@ -76,11 +68,29 @@ def search(filepath, num=5, **search_params):
         dimensions = res.select(".rg_anbg")[0].select(".rg_an")[0]
         dimensions = re.findall(r"(\d+)\s×\s(\d+)", dimensions.string)[0]
 
-        out.append(SearchResult(
+        yield SearchResult(
             dimensions,
             meta['pt'],
             meta['ru'],
-            meta['s']))
-        # No need to continue if enough results have been gathered
-        if (len(out) >= num): break
-    return out
+            meta['s'])
+
+def search(filepath, num=5, **search_params):
+    """
+    Returns a list of SearchResult objects obtained with Google Images.
+
+    Arguments:
+        - filepath: the path to the image file to search
+    Optional:
+        - num: Maximum number of search results to return (default = 5)
+        - params: a dictionary of search GET parameters
+    """
+    results = []
+    with contextlib.closing(iter_results(filepath, num=num,
+                                         **search_params)) as stream:
+        try:
+            for res in itertools.islice(stream, num):
+                results.append(res)
+        except Exception as e:
+            # The results gathered before the error are returned
+            logging.error(str(e))
+    return results
@@ -0,0 +1,51 @@
+# Parsing of the engines' results pages. Each kind of page only needs a few
+# blocks, so BeautifulSoup is given a SoupStrainer that keeps these blocks and
+# skips building the rest of the tree. The lxml tree builder is used when it is
+# installed, and the pure Python html.parser otherwise. BeautifulSoup is only
+# imported when the first page is parsed.
+
+import importlib.util
+
+from .. import metrics
+
+if importlib.util.find_spec('lxml') is not None:
+    backend = 'lxml'
+else:
+    backend = 'html.parser'
+
+# Blocks kept for each kind of page, as (tag name, attributes) arguments of
+# bs4.SoupStrainer (None keeps the whole page)
+strainers = {
+    'GOOGLE': ('div', {'class': '_NId'}),
+    # Blocks of the first page shared by the best guess, the results and the
+    # link to all sizes (see 'google.ResultsPage')
+    'GOOGLE_PAGE': (None, {'class': ['_NId', '_gUb', '_v6']}),
+    'GOOGLE_IMAGES': (None, {'class': 'rg_bx'}),
+    'TINEYE': ('div', {'class': 'match-row'}),
+}
+_strainers = {}
+
+def strainer(page):
+    """Returns the SoupStrainer of a kind of page, or None."""
+    import bs4
+    if page not in strainers:
+        return None
+    if page not in _strainers:
+        name, attrs = strainers[page]
+        _strainers[page] = bs4.SoupStrainer(name, attrs=attrs)
+    return _strainers[page]
+
+def parse(content, page=None):
+    """
+    Returns a BeautifulSoup tree of an HTML document, built with 'backend'.
+
+    Arguments:
+        - content: the HTML document (bytes or string)
+    Optional:
+        - page: the kind of page parsed (a key of 'strainers'). Only the blocks
+        needed for that page are built.
+    Parsing is timed in the metrics, with the kind of page as engine.
+    """
+    import bs4
+    with metrics.timed('parse', page):
+        return bs4.BeautifulSoup(content, backend, parse_only=strainer(page))
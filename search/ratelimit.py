@@ -0,0 +1,129 @@
+# Request scheduling per host. Each engine host gets a token bucket limiting
+# the rate of requests, which adapts to the engine with AIMD: the rate grows
+# slowly while requests succeed and is halved whenever the engine throttles us
+# (429 or 503 status, captcha page). Waiting requests are served in arrival
+# order, so that no image is starved by the others.
+
+import time
+import threading
+from collections import deque
+
+# Initial rate (requests per second) of the hosts that are rate limited. Other
+# hosts, such as the source pages of results, are not limited.
+rates = {
+    'encrypted.google.com': 2.0,
+    'www.google.com': 2.0,
+    'tineye.com': 2.0,
+}
+burst = 2               # Requests that can be sent at once after a pause
+max_rate = 20.0         # Upper bound of the adapted rates
+min_rate = 0.05         # Lower bound of the adapted rates
+increase = 0.1          # Rate added after each successful request
+decrease = 0.5          # Factor applied to the rate when throttled
+pause = 10              # Seconds without requests after being throttled
+
+# Markers of the pages served instead of results when throttled
+throttle_statuses = (429, 503)
+throttle_markers = [b'/sorry/index', b'g-recaptcha', b'unusual traffic']
+
+_buckets = {}
+_buckets_guard = threading.Lock()
+
+class TokenBucket():
+    """Token bucket with adaptive rate and first-come first-served waiting.
+
+    Arguments:
+        - rate: number of requests allowed per second
+        - capacity: maximum number of tokens saved during idle periods
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Waits for a token, after the requests that arrived earlier."""
+        with self._cond:
+            ticket = object()
+            self._queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._queue[0] is ticket:
+                        if now >= self.blocked_until and self.tokens >= 1:
+                            self.tokens = self.tokens - 1
+                            return
+                        delay = max(self.blocked_until - now,
+                                    (1 - self.tokens) / self.rate)
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def feedback(self, throttled, retry_after=None):
+        """
+        Adapts the rate: additive increase after a successful request,
+        multiplicative decrease and a pause when throttled.
+        """
+        with self._cond:
+            if throttled:
+                self.rate = max(min_rate, self.rate * decrease)
+                self.tokens = 0
+                self.blocked_until = time.monotonic() + (retry_after or pause)
+            else:
+                self.rate = min(max_rate, self.rate + increase)
+            self._cond.notify_all()
+
+def bucket(host):
+    """Returns the token bucket of 'host', or None if it is not limited."""
+    with _buckets_guard:
+        if host not in _buckets:
+            if host not in rates:
+                return None
+            _buckets[host] = TokenBucket(rates[host], burst)
+        return _buckets[host]
+
+def set_rate(host, rate):
+    """
+    Limits the requests sent to 'host' to 'rate' per second. A rate of None
+    removes the limit.
+    """
+    with _buckets_guard:
+        if rate is None:
+            rates.pop(host, None)
+        else:
+            rates[host] = rate
+        _buckets.pop(host, None)
+
+def is_throttled(response, streamed=False):
+    """
+    Tells whether a requests response is a throttling answer of an engine
+    rather than actual results.
+    """
+    if response.status_code in throttle_statuses:
+        return True
+    if '/sorry/' in response.headers.get('Location', ''):
+        return True
+    if not streamed and response.status_code == 200:
+        content = response.content.lower()
+        return any(marker in content for marker in throttle_markers)
+    return False
+
+def retry_after(response):
+    """Returns the delay in seconds requested by a response, or None."""
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
@@ -6,9 +6,23 @@ class SearchResult():
         - title: title of the source link containing the image
         - location: link to the source of the image
         - snippet: a description of the image in its source context
+        - engine: name of the engine that returned the result (optional)
     """
-    def __init__(self, dimensions, title, location, snippet):
+    def __init__(self, dimensions, title, location, snippet, engine=None):
         self.dimensions = dimensions
         self.title = title
         self.location = location
         self.snippet = snippet
+        self.engine = engine
+
+    def to_dict(self):
+        """Returns a JSON serializable representation of the result."""
+        return {'dimensions': list(self.dimensions), 'title': self.title,
+                'location': self.location, 'snippet': self.snippet,
+                'engine': self.engine}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Builds a result from the output of 'to_dict'."""
+        return cls(tuple(data['dimensions']), data['title'], data['location'],
+                   data['snippet'], data.get('engine'))
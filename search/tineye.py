@@ -1,12 +1,15 @@
 import os
 import logging
 import re
-
-import requests
-import bs4
+import itertools
+import contextlib
 
 from .result import SearchResult
-from .utils import page_title
+from . import transport
+from .parsing import parse
+from . import utils
+from .utils import page_titles, query_string, PagePrefetcher
+from .upload import query_image
 
 # Global variables for Google search
 user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:54.0) Gecko/20100101 Firefox/54.0'
@@ -15,16 +18,18 @@ baseUrl = 'https://tineye.com/search'
 def fetch_url(filepath):
     """
     Returns the URL containing TinEye's search results for an image.
+    Large images are replaced by a reduced query image.
 
     Arguments:
         - filepath: the path to the image file to search
     """
     try:
-        with open(filepath, 'rb') as f:
+        query = query_image(filepath)
+        with open(query, 'rb') as f:
             # ATTENTION!!!
             # The file basename needs to be specified for the request to work
-            multipart = {'image': (os.path.basename(filepath), f)}
-            response = requests.post(baseUrl,
+            multipart = {'image': (os.path.basename(query), f)}
+            response = transport.post(baseUrl, engine='TINEYE',
                 files=multipart,
                 allow_redirects=False)
             return response.headers['Location']
@@ -32,36 +37,41 @@ def fetch_url(filepath):
         logging.error(str(e))
         return None
 
-def search(filepath, num=5, **search_params):
+def iter_results(filepath, num=None, **search_params):
     """
-    Returns a list of SearchResult objects obtained with TinEye.
+    Generates the SearchResult objects obtained with TinEye, page after page.
+    Once the consumer has pulled half of a page, the next page is fetched in
+    the background if the consumer needs more results than the page holds.
+    Network errors are raised, so that consumers can tell a search cut short
+    from a complete one.
 
     Arguments:
         - filepath: the path to the image file to search
     Optional:
-        - num: Maximum number of search results to return (default = 5)
+        - num: Maximum number of results the consumer takes (default: all)
         - params: a dictionary of search GET parameters
     """
     searchUrl = fetch_url(filepath)
-    out=[]      # Output list of SearchResult objects
-    page = 1    # Results page
-    params = '' # String containing specific search GET parameters
-    for p, val in search_params:
-        params = params + '&' + p + '=' + val
+    if not searchUrl:
+        return
+    params = query_string(search_params)
 
-    while(len(out) < num):
-        # Get results page
-        try:
-            response = requests.get(searchUrl + '?page=' + str(page) + params,
-                headers={'User-Agent': user_agent})
-        except Exception as e:
-            logging.error(str(e))
-            return out
+    def fetch(page):
+        return transport.get(searchUrl + '?page=' + str(page) + params,
+            engine='TINEYE', headers={'User-Agent': user_agent})
 
-        soup = bs4.BeautifulSoup(response.content, "html.parser")
-        # extract results in 'match-row' blocks
-        results = soup.find_all("div", class_="match-row")
-        if len(results) > 0:
+    pages = PagePrefetcher(fetch, needed=num)
+    try:
+        while True:
+            # Get results page
+            response = pages.get()
+            soup = parse(response.content, 'TINEYE')
+            # extract results in 'match-row' blocks
+            results = soup.find_all("div", class_="match-row")
+            if len(results) == 0:
+                return  # We may have reached the end of results
+            # Parse the page first, then fetch the titles concurrently
+            rows = []
             for res in results:
                 thumbnail = res.select('.match-thumb')[0]
                 details = res.select('.match-details')[0]
@@ -69,16 +79,45 @@ def search(filepath, num=5, **search_params):
                 dimensions = thumbnail.p.extract()
                 dimensions = re.findall(r"(\d+)x(\d+)", dimensions.text)[0]
                 location = img_link.find_next_siblings('p')[1].a.get('href')
+                rows.append((dimensions, location,
+                             details.select('.match')[0].text))
 
-                out.append(SearchResult(
-                    dimensions,
-                    page_title(location),
-                    location,
-                    details.select('.match')[0].text))
-                # No need to continue if enough results have been gathered
-                if (len(out) >= num): break
+            titles = []
+            for i, (dimensions, location, match) in enumerate(rows):
+                if i >= len(rows) // 2:
+                    pages.prefetch(left=len(rows) - i)
+                if i == len(titles):
+                    # Only the titles of the rows the consumer takes are
+                    # fetched, a batch of connections at a time
+                    count = min(len(rows) - i, utils.title_workers)
+                    if pages.needed is not None:
+                        count = max(1, min(count, pages.needed))
+                    titles.extend(page_titles(
+                        [location for d, location, m in rows[i:i + count]]))
+                pages.taken()
+                yield SearchResult(dimensions, titles[i], location, match)
+            pages.advance()
+    finally:
+        pages.close()
 
-            page = page + 1
-        else:   # We may have reached the end of results
-            break
-    return out
+def search(filepath, num=5, **search_params):
+    """
+    Returns a list of SearchResult objects obtained with TinEye.
+    Pages are only fetched until 'num' results have been gathered.
+
+    Arguments:
+        - filepath: the path to the image file to search
+    Optional:
+        - num: Maximum number of search results to return (default = 5)
+        - params: a dictionary of search GET parameters
+    """
+    results = []
+    with contextlib.closing(iter_results(filepath, num=num,
+                                         **search_params)) as stream:
+        try:
+            for res in itertools.islice(stream, num):
+                results.append(res)
+        except Exception as e:
+            # The results gathered before the error are returned
+            logging.error(str(e))
+    return results
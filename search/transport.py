@@ -0,0 +1,138 @@
+# Shared HTTP layer used by all search engines. A single requests.Session keeps
+# connections alive in per-host pools, so that successive requests to the same
+# engine do not pay for a new TCP and TLS handshake, and retries failed
+# requests with an exponential backoff.
+
+import os
+import logging
+import threading
+from urllib.parse import urlparse
+
+from . import ratelimit
+from .. import metrics
+from ..utils.exceptions import ThrottledError
+
+# Session settings (see 'configure')
+pool_connections = 10   # Number of hosts for which a pool is kept
+pool_maxsize = 10       # Maximum number of connections kept alive per host
+max_retries = 3         # Retries on connection errors and 'retry_statuses'
+backoff_factor = 0.5    # Retries wait backoff_factor * 2^(retry - 1) seconds
+retry_statuses = (500, 502, 504)   # 429 and 503 are left to ratelimit
+timeout = 30            # Default timeout of a request in seconds
+throttle_retries = 2    # Retries of requests throttled by an engine
+
+_session = None
+_lock = threading.Lock()
+
+def configure(**settings):
+    """
+    Changes the session settings: pool_connections, pool_maxsize, max_retries,
+    backoff_factor, retry_statuses, timeout, throttle_retries.
+    The shared session is rebuilt on the next request.
+    """
+    global _session
+    names = ('pool_connections', 'pool_maxsize', 'max_retries',
+             'backoff_factor', 'retry_statuses', 'timeout', 'throttle_retries')
+    with _lock:
+        for name, value in settings.items():
+            if name not in names:
+                raise TypeError("Unknown session setting '" + name + "'")
+            globals()[name] = value
+        _session = None
+
+def new_session():
+    """
+    Returns a requests.Session configured with the current settings.
+    """
+    # requests is only imported when the network is actually used
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=max_retries, backoff_factor=backoff_factor,
+        status_forcelist=retry_statuses,
+        allowed_methods=frozenset(['GET', 'HEAD', 'POST']),
+        raise_on_status=False, respect_retry_after_header=False)
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_session():
+    """Returns the session shared by all engines."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = new_session()
+        return _session
+
+def set_session(session):
+    """
+    Replaces the session shared by all engines, e.g. with a session using a
+    proxy or custom adapters.
+    """
+    global _session
+    with _lock:
+        _session = session
+
+def get(url, engine=None, stage='get', **kwargs):
+    """
+    Sends a GET request through the shared session. The request is timed as
+    'stage' of 'engine' in the metrics (not timed if 'stage' is None).
+    """
+    return request('GET', url, engine=engine, stage=stage, **kwargs)
+
+def post(url, engine=None, stage='upload', **kwargs):
+    """
+    Sends a POST request through the shared session. The request is timed as
+    'stage' of 'engine' in the metrics (not timed if 'stage' is None).
+    """
+    return request('POST', url, engine=engine, stage=stage, **kwargs)
+
+def buffered(value):
+    """
+    Returns a 'files' entry of requests with the content of its file object
+    read into bytes.
+    """
+    if isinstance(value, tuple) and hasattr(value[1], 'read'):
+        return (value[0], value[1].read()) + value[2:]
+    if hasattr(value, 'read'):
+        name = os.path.basename(str(getattr(value, 'name', ''))) or None
+        return (name, value.read())
+    return value
+
+def request(method, url, engine=None, stage=None, **kwargs):
+    """
+    Sends a request through the shared session, within the rate limits of the
+    host. Throttled requests are sent again after the host's pause, up to
+    'throttle_retries' times, before ThrottledError is raised.
+    """
+    kwargs.setdefault('timeout', timeout)
+    streamed = kwargs.get('stream', False)
+    # Uploaded files are read once, so that every attempt sends them in full
+    if kwargs.get('files'):
+        kwargs['files'] = {field: buffered(value)
+                           for field, value in kwargs['files'].items()}
+    host = urlparse(url).hostname
+    limiter = ratelimit.bucket(host)
+    for attempt in range(throttle_retries + 1):
+        if limiter:
+            limiter.acquire()
+        if stage is None:
+            response = get_session().request(method, url, **kwargs)
+        else:
+            with metrics.timed(stage, engine) as measure:
+                response = get_session().request(method, url, **kwargs)
+                metrics.track(response, measure, streamed=streamed)
+        if not limiter:
+            return response
+        throttled = ratelimit.is_throttled(response, streamed=streamed)
+        limiter.feedback(throttled, ratelimit.retry_after(response))
+        if not throttled:
+            return response
+        response.close()
+        logging.warning(host + " is throttling requests (attempt "
+            + str(attempt + 1) + ")")
+    raise ThrottledError(host + " kept throttling requests")
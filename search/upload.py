@@ -0,0 +1,67 @@
+# Query images: engines only need a few hundred pixels to match an image, so
+# large files can be replaced by a downscaled JPEG copy before being uploaded.
+# Copies are kept in the data directory, keyed by the hash of the original
+# content. Dimensions used for scoring are still read from the original file.
+# Requires Pillow, imported when a copy is made; the original file is uploaded
+# when it is not installed.
+
+import os
+import logging
+import threading
+
+from ..utils.hashing import file_hash
+from ..utils.paths import data_path
+
+# Query image settings (see 'configure')
+max_edge = None         # Longest edge of query images in pixels (None: off)
+quality = 85            # JPEG quality of query images
+min_bytes = 512 * 1024  # Smaller files are uploaded as they are
+
+_lock = threading.Lock()
+
+def configure(**settings):
+    """
+    Changes the query image settings: max_edge, quality, min_bytes.
+    """
+    with _lock:
+        for name, value in settings.items():
+            if name not in ('max_edge', 'quality', 'min_bytes'):
+                raise TypeError("Unknown upload setting '" + name + "'")
+            globals()[name] = value
+
+def query_image(filepath):
+    """
+    Returns the path of the file to upload to search the image at 'filepath':
+    a downscaled JPEG copy if the image is larger than 'max_edge', or the
+    original file otherwise.
+    """
+    if max_edge is None:
+        return filepath
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return filepath
+    try:
+        if os.path.getsize(filepath) < min_bytes:
+            return filepath
+        name = file_hash(filepath) + '_' + str(max_edge) + '_' + str(quality)
+        path = data_path(os.path.join('queries', name + '.jpg'))
+        if os.path.exists(path):
+            return path
+
+        with Image.open(filepath) as img:
+            if max(img.size) <= max_edge:
+                return filepath
+            img.draft('RGB', (max_edge, max_edge))  # Faster JPEG decoding
+            # The copy has no EXIF data: the orientation is applied to pixels
+            img = ImageOps.exif_transpose(img).convert('RGB')
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            # Write to a temporary file so that readers never see a partial copy
+            tmp = path + '.' + str(threading.get_ident()) + '.tmp'
+            img.save(tmp, 'JPEG', quality=quality, optimize=True)
+        os.replace(tmp, path)
+        return path
+    except Exception as e:
+        logging.warning("Couldn't reduce " + os.path.basename(filepath)
+            + ": " + str(e))
+        return filepath
@@ -1,21 +1,165 @@
 import re
 import os
+import html
+import time
 import logging
+import threading
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
+from . import transport
+from .. import cache, metrics
+
+# Limits applied when fetching the title of a page
+title_max_bytes = 64 * 1024     # Bytes read at most from the page
+title_timeout = 10              # Seconds allowed to fetch the page
+title_workers = 16              # Pages fetched at once, at most as many as
+                                # the connections kept alive per host
+
+_title_regex = re.compile(r"<title[^>]*>(.*?)</title", re.IGNORECASE | re.DOTALL)
+
+# Threads resolving page titles concurrently (see 'title_workers')
+_title_executor = None
+_title_workers = None
+_title_lock = threading.Lock()
 
 def page_title(url):
+    """
+    Returns the title of the page at 'url', or '' if the page has no title.
+    At most 'title_max_bytes' bytes are read within 'title_timeout' seconds.
+    Titles are kept in the persistent cache, so that each page is only
+    fetched once.
+    """
+    title = cache.get(['TITLE', url])
+    if title is not None:
+        return title
+    with metrics.timed('title') as measure:
+        title = fetch_title(url, measure)
+    if title is None:
+        return os.path.basename(url)  # Title by default if none can be found
+    cache.put(['TITLE', url], title)
+    return title
+
+def fetch_title(url, measure=None):
+    """
+    Fetches the title of the page at 'url'. Returns '' if the page has no
+    title, and None if the page could not be retrieved. The bytes read are
+    added to the metrics 'measure' if given.
+    """
+    start = time.monotonic()
     try:
-        r = requests.get(url, stream=True)
-        # Read up to the </title> closing
-        chunk = r.iter_lines(decode_unicode=True, delimiter='</title>')
+        r = transport.get(url, stage=None, stream=True, timeout=title_timeout)
     except:
         logging.info('Couldn\'t retrieve page title at ' + url)
-        return os.path.basename(url)  # Title by default if none can be found
+        return None
+
+    # Closing the response gives the connection back to the pool
+    content = bytearray()
+    with r:
+        try:
+            # Read up to the </title> closing
+            for chunk in r.iter_content(chunk_size=4096):
+                content.extend(chunk)
+                if (b'</title' in content[-len(chunk)-7:].lower()
+                        or len(content) >= title_max_bytes
+                        or time.monotonic() - start > title_timeout):
+                    break
+        except Exception:
+            logging.info('Couldn\'t retrieve page title at ' + url)
+            return None
+        encoding = r.encoding or 'utf-8'
+    if measure:
+        measure.received = measure.received + len(content)
 
-    chunk = chunk.__next__()
-    title = re.findall(r"<title>(.*)", chunk)
+    content = bytes(content[:title_max_bytes])
+    try:
+        text = content.decode(encoding, errors='replace')
+    except LookupError:
+        text = content.decode('utf-8', errors='replace')
+    title = _title_regex.findall(text)
     if title:
-        return title[0].strip()
+        return html.unescape(title[0]).strip()
     else:
         return ''
+
+def page_titles(urls):
+    """
+    Returns the titles of the pages at 'urls', fetched concurrently by at most
+    'title_workers' threads, and never more than 'transport.pool_maxsize' so
+    that no kept-alive connection is discarded.
+    """
+    global _title_executor, _title_workers
+    workers = max(1, min(title_workers, transport.pool_maxsize))
+    with _title_lock:
+        if _title_workers != workers:
+            # Titles being fetched by the previous threads are still returned
+            if _title_executor is not None:
+                _title_executor.shutdown(wait=False)
+            _title_executor = ThreadPoolExecutor(max_workers=workers,
+                thread_name_prefix='imgnamer-title')
+            _title_workers = workers
+        futures = [_title_executor.submit(page_title, url) for url in urls]
+    return [future.result() for future in futures]
+
+def query_string(search_params):
+    """
+    Returns the string of GET parameters appended to search URLs, starting with
+    '&' (empty if there is no parameter).
+    """
+    if not search_params:
+        return ''
+    return '&' + urlencode(search_params)
+
+# Threads fetching results pages ahead of the consumers
+prefetch_workers = 8
+_prefetch_executor = ThreadPoolExecutor(max_workers=prefetch_workers,
+    thread_name_prefix='imgnamer-prefetch')
+
+class PagePrefetcher():
+    """Fetches numbered results pages, one page ahead in the background.
+
+    Arguments:
+        - fetch: function returning the response (or the parsed results) for
+        a page number
+        - first: number of the first page (default = 1)
+        - needed: (optional) number of results the consumer takes at most. The
+        next page is not prefetched while the current page holds them all.
+    """
+    def __init__(self, fetch, first=1, needed=None):
+        self.fetch = fetch
+        self.page = first
+        self.needed = needed
+        self._next = None
+
+    def get(self):
+        """Returns the response of the current page."""
+        if self._next is not None:
+            future, self._next = self._next, None
+            return future.result()
+        return self.fetch(self.page)
+
+    def taken(self, count=1):
+        """Records that the consumer took 'count' more results."""
+        if self.needed is not None:
+            self.needed = self.needed - count
+
+    def prefetch(self, left=0):
+        """
+        Starts fetching the page following the current one, unless the 'left'
+        results not taken yet from the current page are all the consumer
+        still needs.
+        """
+        if self.needed is not None and self.needed <= left:
+            return
+        if self._next is None:
+            self._next = _prefetch_executor.submit(self.fetch, self.page + 1)
+
+    def advance(self):
+        """Moves to the next page."""
+        self.page = self.page + 1
+
+    def close(self):
+        """Gives up the page being prefetched, if any."""
+        if self._next is not None:
+            self._next.cancel()
+            self._next = None
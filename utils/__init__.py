@@ -1,3 +1,4 @@
 from . import exceptions
 from .size import get_image_size
 from .rename import rename
+from .hashing import file_hash
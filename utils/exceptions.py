@@ -1,2 +1,6 @@
 class UnknownImageFormat(Exception):
     pass
+
+class ThrottledError(Exception):
+    """Raised when a search engine keeps throttling our requests."""
+    pass
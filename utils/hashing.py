@@ -0,0 +1,33 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Content hashes memoized by (path, modification time, size)
+_hashes = OrderedDict()
+_hashes_guard = threading.Lock()
+max_memoized = 4096
+
+def file_hash(filepath):
+    """
+    Returns the SHA-1 hex digest of the content of the file at 'filepath'.
+    The digest is only computed again if the file has been modified.
+    """
+    st = os.stat(filepath)
+    key = (os.path.abspath(filepath), st.st_mtime_ns, st.st_size)
+    with _hashes_guard:
+        if key in _hashes:
+            _hashes.move_to_end(key)
+            return _hashes[key]
+
+    h = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    digest = h.hexdigest()
+
+    with _hashes_guard:
+        _hashes[key] = digest
+        if len(_hashes) > max_memoized:
+            _hashes.popitem(last=False)
+    return digest
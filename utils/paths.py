@@ -0,0 +1,14 @@
+import os
+
+def data_path(name):
+    """
+    Returns the path of 'name' inside imgnamer's data directory, which is
+    created if needed, along with the sub-directories of 'name'. The directory
+    defaults to '~/.cache/imgnamer' and can be changed with the
+    IMGNAMER_CACHE_DIR environment variable.
+    """
+    directory = os.environ.get('IMGNAMER_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'imgnamer'))
+    path = os.path.join(directory, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
@@ -0,0 +1,96 @@
+# Perceptual hashing of images, used to recognize the same picture saved at
+# different sizes or recompressed. Requires Pillow, which is only imported when
+# an image is hashed.
+
+import logging
+
+from .hashing import file_hash
+from .. import cache
+
+# Number of bits of the perceptual hashes
+hash_bits = 64
+
+def dhash(filepath):
+    """
+    Returns the 64-bit difference hash of the image at 'filepath': the image is
+    reduced to 9x8 grey pixels and each bit tells whether a pixel is brighter
+    than its right neighbour. Hashes are kept in the persistent cache.
+    Raises ImportError if Pillow is not installed.
+    """
+    key = ['PHASH', file_hash(filepath)]
+    value = cache.get(key)
+    if value is not None:
+        return value
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError("Perceptual hashing requires Pillow")
+
+    with Image.open(filepath) as img:
+        img.draft('L', (64, 64))    # Let JPEG decoders skip full resolution
+        img = img.convert('L').resize((9, 8), Image.LANCZOS)
+        pixels = list(img.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    cache.put(key, value)
+    return value
+
+def hamming(a, b):
+    """Returns the number of differing bits between two hashes."""
+    return bin(a ^ b).count('1')
+
+def split_hash(value, parts):
+    """
+    Splits a hash into 'parts' chunks of (almost) equal size. Two hashes within
+    a Hamming distance lower than 'parts' have at least one identical chunk.
+    """
+    chunks = []
+    start = 0
+    for i in range(parts):
+        size = hash_bits // parts + (1 if i < hash_bits % parts else 0)
+        chunks.append((value >> start) & ((1 << size) - 1))
+        start = start + size
+    return chunks
+
+def group_duplicates(paths, max_distance=4):
+    """
+    Groups the images at 'paths' whose perceptual hashes are within
+    'max_distance' bits of each other. Returns a list of groups (lists of
+    paths sorted by name), in the order of their first path in 'paths'.
+    Images that cannot be hashed are returned as groups of their own.
+    """
+    hashes = {}
+    for path in paths:
+        try:
+            hashes[path] = dhash(path)
+        except ImportError as e:
+            logging.warning(str(e) + ": duplicates are not detected")
+            return [[path] for path in paths]
+        except Exception as e:
+            logging.info("Couldn't hash " + path + ": " + str(e))
+
+    # Union-find over candidate pairs sharing a chunk (multi-index hashing)
+    parent = {path: path for path in paths}
+    def find(path):
+        while parent[path] != path:
+            parent[path] = parent[parent[path]]
+            path = parent[path]
+        return path
+
+    buckets = {}
+    for path, value in hashes.items():
+        for i, chunk in enumerate(split_hash(value, max_distance + 1)):
+            for other in buckets.setdefault((i, chunk), []):
+                if hamming(value, hashes[other]) <= max_distance:
+                    parent[find(path)] = find(other)
+            buckets[(i, chunk)].append(path)
+
+    # Groups are created in the order of their first path
+    groups = {}
+    for path in paths:
+        groups.setdefault(find(path), []).append(path)
+    return [sorted(group) for group in groups.values()]
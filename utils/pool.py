@@ -0,0 +1,19 @@
+from concurrent.futures import wait, FIRST_COMPLETED
+
+def bounded_map(executor, function, items, limit):
+    """
+    Generates the results of 'function' applied to 'items' by 'executor', in
+    completion order. At most 'limit' items are submitted ahead of the workers,
+    so that 'items' may be a stream of any length.
+    """
+    pending = set()
+    for item in items:
+        pending.add(executor.submit(function, item))
+        if len(pending) >= limit:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
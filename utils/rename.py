@@ -1,24 +1,99 @@
 import os
+import errno
 import logging
+import threading
 
 from .exceptions import UnknownImageFormat
+from .. import metrics
 
 # Prepare a table of forbidden filename characters to remove from filenames
 forbidden_chars = ['\\', '/', ':', '*', '?', '"', '<', '>', '|']
 forbidden_chars = str.maketrans({key: None for key in forbidden_chars})
 
-def rename(filepath, new_name):
+# One lock per directory so that concurrent renames in the same folder cannot
+# pick the same target name. Other processes are not bound by these locks:
+# 'move' never replaces a file, whoever created it.
+_dir_locks = {}
+_dir_locks_guard = threading.Lock()
+
+def directory_lock(directory):
+    """
+    Returns the lock guarding renames inside 'directory'.
+    """
+    directory = os.path.abspath(directory)
+    with _dir_locks_guard:
+        if directory not in _dir_locks:
+            _dir_locks[directory] = threading.Lock()
+        return _dir_locks[directory]
+
+def available_path(directory, name, extension, current=None):
+    """
+    Returns a path in 'directory' for 'name' that does not collide with an
+    existing file. A numbered suffix is appended when necessary, e.g.
+    'name (2).ext'. The file at 'current' (if any) is not considered a
+    collision.
+    """
+    candidate = os.path.join(directory, name + '.' + extension)
+    n = 2
+    while (os.path.exists(candidate) and not (current
+            and os.path.abspath(candidate) == os.path.abspath(current))):
+        candidate = os.path.join(directory,
+            name + ' (' + str(n) + ').' + extension)
+        n = n + 1
+    return candidate
+
+def move(src, dst):
+    """
+    Renames the file at 'src' into 'dst' without ever replacing a file.
+    FileExistsError is raised if 'dst' exists, even when it was just created
+    by another process.
+    """
+    try:
+        # Creating the link fails if the target exists, atomically
+        os.link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError:
+        # Filesystems without hard links: best effort check before renaming
+        if os.path.lexists(dst):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+        os.rename(src, dst)
+        return
+    os.unlink(src)
+
+def rename(filepath, new_name, reserved=None):
     """
     Rename a file at the specified 'filepath' with it 'new_name'.
     The exension and contaning directory will the same as before.
+    An existing file is never overwritten: a numbered suffix is added instead.
+    The new filepath is added to the set 'reserved' (if given) before the file
+    is moved, so that scanners never see it there unannounced, and removed
+    from it again if the move fails.
+    Returns the new filepath, or None if the file was not renamed.
     """
     new_name = new_name.translate(forbidden_chars)  # Strip forbidden characters
     extension = os.path.basename(filepath).split('.')[-1]
     if new_name:
-        new_name =  new_name + '.' + extension
         # Constitute new filepath & rename the file
         directory = os.path.dirname(filepath)
-        new_filepath = os.path.join(directory, new_name)
-        os.rename(filepath, new_filepath)
+        with metrics.timed('rename'), directory_lock(directory):
+            while True:
+                new_filepath = available_path(directory, new_name, extension,
+                    current=filepath)
+                if os.path.abspath(new_filepath) == os.path.abspath(filepath):
+                    break
+                if reserved is not None:
+                    reserved.add(new_filepath)
+                try:
+                    move(filepath, new_filepath)
+                    break
+                except BaseException as e:
+                    if reserved is not None:
+                        reserved.discard(new_filepath)
+                    if not isinstance(e, FileExistsError):
+                        raise
+                    # Taken by another process meanwhile: try the next name
         logging.info("renamed '" + os.path.basename(filepath)
             + "' into '" + os.path.basename(new_filepath))
+        return new_filepath
+    return None
@@ -12,64 +12,243 @@
 #!/usr/bin/env python
 
 import os
+import mmap
 import struct
+import threading
+from collections import OrderedDict
+
+from .exceptions import UnknownImageFormat
+
+# Number of bytes read at the beginning of a file to identify its format
+header_size = 4096
+
+# Dimensions memoized by (path, modification time, size)
+max_memoized = 4096
+_sizes = OrderedDict()
+_sizes_guard = threading.Lock()
 
 def get_image_size(file_path):
     """
     Return (width, height) for a given img file content - no external
-    dependencies except the os and struct modules from core
+    dependencies except the os and struct modules from core.
+    Dimensions are only parsed again if the file has been modified.
+    """
+    st = os.stat(file_path)
+    key = (os.path.abspath(file_path), st.st_mtime_ns, st.st_size)
+    with _sizes_guard:
+        if key in _sizes:
+            _sizes.move_to_end(key)
+            return _sizes[key]
+
+    dimensions = probe_image_size(file_path)
+
+    with _sizes_guard:
+        _sizes[key] = dimensions
+        if len(_sizes) > max_memoized:
+            _sizes.popitem(last=False)
+    return dimensions
+
+def probe_image_size(file_path):
+    """
+    Parses the header of an image file and returns its (width, height).
+    Supported formats: GIF, PNG, JPEG, BMP, WEBP, TIFF, HEIC and AVIF.
     """
     size = os.path.getsize(file_path)
 
     with open(file_path, 'rb') as f:
-        height = -1
-        width = -1
-        data = f.read(25)
+        data = f.read(header_size)
 
         if (size >= 10) and data[:6] in (b'GIF87a', b'GIF89a'):
             # GIFs
             w, h = struct.unpack("<HH", data[6:10])
-            width = int(w)
-            height = int(h)
         elif ((size >= 24) and data.startswith(b'\211PNG\r\n\032\n')
               and (data[12:16] == b'IHDR')):
             # PNGs
             w, h = struct.unpack(">LL", data[16:24])
-            width = int(w)
-            height = int(h)
         elif (size >= 16) and data.startswith(b'\211PNG\r\n\032\n'):
             # older PNGs?
             w, h = struct.unpack(">LL", data[8:16])
-            width = int(w)
-            height = int(h)
         elif (size >= 2) and data.startswith(b'\377\330'):
-            # JPEG
-            msg = " raised while trying to decode as JPEG."
-            f.seek(0)
-            f.read(2)
-            b = f.read(1)
-            try:
-                while (b and ord(b) != 0xDA):
-                    while (ord(b) != 0xFF): b = f.read(1)
-                    while (ord(b) == 0xFF): b = f.read(1)
-                    if (ord(b) >= 0xC0 and ord(b) <= 0xC3):
-                        f.read(3)
-                        h, w = struct.unpack(">HH", f.read(4))
-                        break
-                    else:
-                        f.read(int(struct.unpack(">H", f.read(2))[0])-2)
-                    b = f.read(1)
-                width = int(w)
-                height = int(h)
-            except struct.error:
-                raise UnknownImageFormat("StructError" + msg)
-            except ValueError:
-                raise UnknownImageFormat("ValueError" + msg)
-            except Exception as e:
-                raise UnknownImageFormat(e.__class__.__name__ + msg)
+            # JPEG: segments are scanned in a memory map of the file
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                w, h = _jpeg_size(m)
+        elif (size >= 26) and data.startswith(b'BM'):
+            # BMP
+            w, h = _bmp_size(data)
+        elif (size >= 30) and data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            # WEBP
+            w, h = _webp_size(data)
+        elif (size >= 8) and data[:4] in (b'II*\0', b'MM\0*'):
+            # TIFF: the first directory may lie anywhere in the file
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                w, h = _tiff_size(m)
+        elif (size >= 12) and data[4:8] == b'ftyp':
+            # HEIC / AVIF
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                w, h = _isobmff_size(m)
         else:
             raise UnknownImageFormat(
                 "Sorry, don't know how to get information from this file."
             )
 
-    return width, height
+    return int(w), int(h)
+
+def _jpeg_size(data):
+    msg = " raised while trying to decode as JPEG."
+    try:
+        i = 2
+        end = len(data)
+        while i < end:
+            # Jump to the next marker, skipping fill bytes
+            i = data.find(b'\xff', i)
+            if i == -1:
+                break
+            while i < end and data[i] == 0xFF:
+                i = i + 1
+            marker = data[i]
+            i = i + 1
+            if marker == 0xDA:      # Start of scan: no frame header found
+                break
+            if 0xD0 <= marker <= 0xD9 or marker == 0x01:
+                continue            # Markers without a length field
+            length, = struct.unpack(">H", data[i:i+2])
+            if marker in (0xC0, 0xC1, 0xC2, 0xC3):
+                h, w = struct.unpack(">HH", data[i+3:i+7])
+                return w, h
+            i = i + length
+    except struct.error:
+        raise UnknownImageFormat("StructError" + msg)
+    except (ValueError, IndexError):
+        raise UnknownImageFormat("ValueError" + msg)
+    raise UnknownImageFormat("No frame header" + msg)
+
+def _bmp_size(data):
+    header_length, = struct.unpack("<I", data[14:18])
+    if header_length == 12:
+        return struct.unpack("<HH", data[18:22])
+    w, h = struct.unpack("<ii", data[18:26])
+    return w, abs(h)    # Negative heights describe top-down bitmaps
+
+def _webp_size(data):
+    chunk = data[12:16]
+    if chunk == b'VP8 ':
+        w, h = struct.unpack("<HH", data[26:30])
+        return w & 0x3FFF, h & 0x3FFF
+    elif chunk == b'VP8L':
+        b = data[21:25]
+        w = 1 + (((b[1] & 0x3F) << 8) | b[0])
+        h = 1 + (((b[3] & 0xF) << 10) | (b[2] << 2) | ((b[1] & 0xC0) >> 6))
+        return w, h
+    elif chunk == b'VP8X':
+        w = 1 + int.from_bytes(data[24:27], 'little')
+        h = 1 + int.from_bytes(data[27:30], 'little')
+        return w, h
+    raise UnknownImageFormat("Unknown WEBP chunk " + repr(chunk))
+
+def _tiff_size(data):
+    order = '<' if data[:2] == b'II' else '>'
+    try:
+        offset, = struct.unpack(order + "I", data[4:8])
+        count, = struct.unpack(order + "H", data[offset:offset+2])
+        w = h = None
+        for n in range(count):
+            entry = offset + 2 + n * 12
+            tag, kind = struct.unpack(order + "HH", data[entry:entry+4])
+            if kind == 3:       # SHORT
+                value, = struct.unpack(order + "H", data[entry+8:entry+10])
+            elif kind == 4:     # LONG
+                value, = struct.unpack(order + "I", data[entry+8:entry+12])
+            else:
+                continue
+            if tag == 256:
+                w = value
+            elif tag == 257:
+                h = value
+        if w is None or h is None:
+            raise UnknownImageFormat("TIFF without dimensions.")
+        return w, h
+    except struct.error:
+        raise UnknownImageFormat("StructError raised while decoding TIFF.")
+
+def _isobmff_size(data):
+    """
+    Reads the dimensions of HEIC and AVIF files (ISO media boxes) from the
+    'ispe' property of the primary item, found with the 'pitm' and 'ipma'
+    boxes. Grid images also have 'ispe' properties for their tiles and
+    thumbnails, so the largest one is used if the primary item is unknown.
+    """
+    def boxes(start, end):
+        i = start
+        while i + 8 <= end:
+            length, kind = struct.unpack(">I4s", data[i:i+8])
+            header = 8
+            if length == 1:
+                length, = struct.unpack(">Q", data[i+8:i+16])
+                header = 16
+            elif length == 0:
+                length = end - i
+            if length < header:
+                return
+            yield kind, i + header, min(i + length, end)
+            i = i + length
+    def ispe(body):
+        return struct.unpack(">II", data[body+4:body+12])
+    def primary_size(pitm, ipma, properties):
+        # Full boxes start with a version byte and 3 bytes of flags
+        if data[pitm] == 0:
+            primary, = struct.unpack(">H", data[pitm+4:pitm+6])
+        else:
+            primary, = struct.unpack(">I", data[pitm+4:pitm+8])
+        version = data[ipma]
+        large_index = data[ipma+3] & 1
+        count, = struct.unpack(">I", data[ipma+4:ipma+8])
+        i = ipma + 8
+        for n in range(count):
+            if version == 0:
+                item, = struct.unpack(">H", data[i:i+2])
+                i = i + 2
+            else:
+                item, = struct.unpack(">I", data[i:i+4])
+                i = i + 4
+            associations = data[i]
+            i = i + 1
+            for a in range(associations):
+                # The high bit tells whether the property is essential
+                if large_index:
+                    index = struct.unpack(">H", data[i:i+2])[0] & 0x7fff
+                    i = i + 2
+                else:
+                    index = data[i] & 0x7f
+                    i = i + 1
+                if (item == primary and 0 < index <= len(properties)
+                        and properties[index - 1][0] == b'ispe'):
+                    return ispe(properties[index - 1][1])
+        return None
+    try:
+        found = None
+        # Boxes holding the dimensions: meta > pitm, meta > iprp > ipco/ipma
+        meta = next(((body + 4, end) for kind, body, end
+                     in boxes(0, len(data)) if kind == b'meta'), None)
+        pitm = ipma = None
+        properties = []
+        for kind, body, end in boxes(*meta) if meta else ():
+            if kind == b'pitm':
+                pitm = body
+            elif kind == b'iprp':
+                for kind, body, end in boxes(body, end):
+                    if kind == b'ipco':
+                        properties = list(boxes(body, end))
+                    elif kind == b'ipma' and ipma is None:
+                        ipma = body
+        if pitm is not None and ipma is not None:
+            found = primary_size(pitm, ipma, properties)
+        if not found:
+            sizes = [ispe(body) for kind, body, end in properties
+                     if kind == b'ispe']
+            found = max(sizes, key=lambda size: size[0] * size[1]) \
+                if sizes else None
+    except (struct.error, IndexError):
+        found = None
+    if not found:
+        raise UnknownImageFormat("No dimensions found in HEIC/AVIF file.")
+    return found
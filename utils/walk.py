@@ -0,0 +1,66 @@
+import os
+import fnmatch
+import logging
+
+def walk_files(folder_path, sub_folders=False, extensions=None, min_size=None,
+               max_size=None, min_mtime=None, max_mtime=None, include=None,
+               exclude=None):
+    """
+    Generates the paths of the files in the folder at 'folder_path', as the
+    folder is scanned with os.scandir, so that the listing is never held in
+    memory. Files are generated in directory order, before the files of the
+    sub-folders.
+
+    Arguments:
+    - folder_path: the path to the folder to scan.
+    Optional:
+    - sub_folders: boolean indicating whether sub_folders are also scanned.
+    - extensions: list of accepted file extensions (case insensitive).
+    - min_size, max_size: bounds on the file size in bytes.
+    - min_mtime, max_mtime: bounds on the modification time (timestamps).
+    - include: list of glob patterns, one of which the file name must match.
+    - exclude: list of glob patterns matching the names of the files and
+    folders to ignore.
+    """
+    if extensions is not None:
+        extensions = set(ext.lower() for ext in extensions)
+    bounds = (min_size, max_size, min_mtime, max_mtime)
+
+    def accept(entry):
+        if (extensions is not None and
+                entry.name.split('.')[-1].lower() not in extensions):
+            return False
+        if include and not any(fnmatch.fnmatch(entry.name, pattern)
+                               for pattern in include):
+            return False
+        if bounds != (None, None, None, None):
+            st = entry.stat()
+            if ((min_size is not None and st.st_size < min_size) or
+                    (max_size is not None and st.st_size > max_size) or
+                    (min_mtime is not None and st.st_mtime < min_mtime) or
+                    (max_mtime is not None and st.st_mtime > max_mtime)):
+                return False
+        return True
+
+    # Directories are scanned depth-first with an explicit stack
+    stack = [folder_path]
+    while stack:
+        folders = []
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if exclude and any(fnmatch.fnmatch(entry.name, pattern)
+                                       for pattern in exclude):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            if sub_folders:
+                                folders.append(entry.path)
+                        elif entry.is_file() and accept(entry):
+                            yield entry.path
+                    except OSError as e:
+                        logging.warning(str(e))
+        except OSError as e:
+            logging.warning(str(e))
+        # Sub-folders are visited in the order they were found
+        stack.extend(reversed(folders))
@@ -0,0 +1,278 @@
+# Watch-folder mode. Folders are watched for new images with inotify on Linux,
+# or scanned periodically elsewhere. A new file is renamed once its size and
+# modification time have not changed for 'settle' seconds, so that images
+# still being downloaded or copied are left alone. Files waiting for a worker
+# are recorded in a journal and queued again after a restart. The worker pool,
+# HTTP sessions and compiled patterns stay warm for the whole run.
+
+import os
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .journal import Journal, QUEUED, PENDING, RENAMED, FAILED
+from .img_search import set_engine_limit
+from .search import transport
+from .utils.hashing import file_hash
+from .utils.paths import data_path
+from .utils.walk import walk_files
+
+settle = 2.0            # Seconds without changes before a file is renamed
+poll_interval = 5.0     # Seconds between two scans without inotify
+
+# inotify constants, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+_event = struct.Struct('iIII')
+
+def _libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        return None
+    return libc if hasattr(libc, 'inotify_init1') else None
+
+class InotifyWatcher():
+    """Reports the files written or moved into folders, using inotify.
+
+    Arguments:
+        - folders: list of the folders to watch
+        - sub_folders: boolean indicating whether sub-folders are also watched
+    """
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, folders, sub_folders=False):
+        self.folders = folders
+        self.sub_folders = sub_folders
+        self._libc = _libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}
+        for folder in folders:
+            self._add(folder)
+
+    def _add(self, folder):
+        """Watches 'folder' (and its sub-folders if needed)."""
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder),
+                                          self.mask)
+        if wd < 0:
+            logging.warning("Couldn't watch " + folder + ': '
+                            + os.strerror(ctypes.get_errno()))
+            return
+        self._dirs[wd] = folder
+        if self.sub_folders:
+            try:
+                with os.scandir(folder) as it:
+                    subdirs = [entry.path for entry in it
+                               if entry.is_dir(follow_symlinks=False)]
+            except OSError:
+                subdirs = []
+            for subdir in subdirs:
+                self._add(subdir)
+
+    def changes(self, timeout):
+        """
+        Waits at most 'timeout' seconds for events and returns the paths of
+        the files created, written or moved into the watched folders.
+        """
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _event.unpack_from(data, offset)
+            offset = offset + _event.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset = offset + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost: everything is reported again
+                for folder in self.folders:
+                    paths.extend(walk_files(folder, self.sub_folders))
+            elif mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+            elif wd in self._dirs and name:
+                path = os.path.join(self._dirs[wd], os.fsdecode(name))
+                if not mask & IN_ISDIR:
+                    paths.append(path)
+                elif self.sub_folders:
+                    # Files may be written before the new folder is watched
+                    self._add(path)
+                    paths.extend(walk_files(path, sub_folders=True))
+        return paths
+
+    def close(self):
+        os.close(self._fd)
+
+class PollingWatcher():
+    """Reports the files that appeared or changed in folders since the last
+    scan, scanning them every 'poll_interval' seconds.
+
+    Arguments:
+        - folders: list of the folders to watch
+        - sub_folders: boolean indicating whether sub-folders are also watched
+    """
+    def __init__(self, folders, sub_folders=False):
+        self.folders = folders
+        self.sub_folders = sub_folders
+        self._next = 0
+        self._known = {}
+        self._scan()
+
+    def _scan(self):
+        self._next = time.monotonic() + poll_interval
+        known = {}
+        for folder in self.folders:
+            for path in walk_files(folder, self.sub_folders):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                known[path] = (st.st_size, st.st_mtime_ns)
+        changed = [path for path, signature in known.items()
+                   if self._known.get(path) != signature]
+        self._known = known
+        return changed
+
+    def changes(self, timeout):
+        """
+        Waits at most 'timeout' seconds and returns the paths of the files
+        that appeared or changed if the folders were scanned meanwhile.
+        """
+        delay = self._next - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0, delay))
+        return self._scan()
+
+    def close(self):
+        pass
+
+def new_watcher(folders, sub_folders=False):
+    """Returns an inotify watcher if possible, or else a polling watcher."""
+    try:
+        return InotifyWatcher(folders, sub_folders)
+    except OSError as e:
+        logging.info('Scanning folders every ' + str(poll_interval)
+                     + ' seconds (' + str(e) + ')')
+        return PollingWatcher(folders, sub_folders)
+
+def img_watch(folders, sub_folders=False, method='BEST_GUESS', engines=None,
+              workers=1, engine_limits=None, deadline=None, journal=None,
+              initial_scan=False, stop_event=None):
+    """
+    Renames the images added to folders as they appear, until 'stop_event' is
+    set or the process is interrupted.
+
+    Arguments:
+    - folders: the path to a folder to watch, or a list of paths.
+    - journal: (optional) path to the journal of the files waiting to be
+    renamed, or a Journal object (default: 'watch.sqlite' in the data folder).
+    Files found by a previous run and not renamed yet are renamed at start.
+    - initial_scan: when True, the images already in the folders are also
+    renamed at start (those recorded as renamed in the journal are skipped).
+    - stop_event: (optional) threading.Event stopping the watch when set.
+    Other arguments are those of 'img_batch_rename'.
+    """
+    from .core import rename_group, supported_ext
+
+    if isinstance(folders, str):
+        folders = [folders]
+    folders = [os.path.abspath(folder) for folder in folders]
+    for folder in folders:
+        if not os.path.isdir(folder):
+            logging.error("No valid directory was found at " + folder)
+            return
+
+    for engine, limit in (engine_limits or {}).items():
+        set_engine_limit(engine, limit)
+    if workers > transport.pool_maxsize:
+        transport.configure(pool_maxsize=workers)
+
+    opened = not isinstance(journal, Journal)
+    if opened:
+        journal = Journal(journal or data_path('watch.sqlite'))
+    stop_event = stop_event or threading.Event()
+
+    produced = set()    # New paths of the renamed files, ignored when seen
+    waiting = {}        # Path -> (size and mtime, time they were first seen)
+    running = set()
+
+    def enqueue(path):
+        # Renamed files are seen again under their new name
+        if path in produced:
+            produced.discard(path)
+            return
+        try:
+            key = file_hash(path)
+        except OSError:
+            return
+        entry = journal.get(path, key=key)
+        if entry and entry['state'] == RENAMED and entry['new_path'] == path:
+            return
+        if entry is None or entry['state'] in (FAILED, RENAMED):
+            journal.mark(path, QUEUED, key=key)
+        running.add(path)
+        future = executor.submit(rename_group, [path], method=method,
+            engines=engines, deadline=deadline, journal=journal,
+            produced=produced)
+        future.add_done_callback(lambda future: running.discard(path))
+
+    def accept(path):
+        return (path.split('.')[-1].lower() in supported_ext
+                and path not in running)
+
+    # Files found by a previous run come first
+    for path in journal.paths(QUEUED, PENDING):
+        if os.path.isfile(path) and accept(path):
+            waiting[path] = None
+    watcher = new_watcher(folders, sub_folders)
+    if initial_scan:
+        for folder in folders:
+            for path in walk_files(folder, sub_folders, extensions=supported_ext):
+                waiting[path] = None
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        while not stop_event.is_set():
+            for path in watcher.changes(settle / 2 if waiting else 1.0):
+                if accept(path):
+                    waiting[path] = None
+            # Files are renamed once they are no longer written
+            now = time.monotonic()
+            for path, seen in list(waiting.items()):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    del waiting[path]
+                    continue
+                signature = (st.st_size, st.st_mtime_ns)
+                if seen is None or seen[0] != signature:
+                    waiting[path] = (signature, now)
+                elif now - seen[1] >= settle and st.st_size > 0:
+                    del waiting[path]
+                    enqueue(path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        executor.shutdown(wait=True)
+        if opened:
+            journal.close()
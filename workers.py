@@ -0,0 +1,166 @@
+# Multi-process batch renaming. The files of a batch are put in a work queue
+# (see 'workqueue') from which worker processes lease a few files at a time,
+# so that parsing and scoring run on all the cores and faster workers simply
+# take more files. The same queue may be shared with workers started on other
+# machines with 'work', e.g. python -m imgnamer work QUEUE_FILE.
+
+import os
+import time
+import logging
+import tempfile
+import threading
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from . import workqueue
+from .workqueue import WorkQueue, worker_id, LEASED
+from .search import ratelimit
+from .utils.walk import walk_files
+
+# Delays between two polls of a queue whose files are all leased by other
+# workers: the first one, doubled after each empty poll up to the last one
+poll_delay = 0.1
+max_poll_delay = 5.0
+
+def enqueue(queue_file, folder_path, sub_folders=False, **filters):
+    """
+    Adds the images of a folder to the work queue at 'queue_file' (created if
+    needed). Filters are those of 'img_batch_rename'.
+    Returns the number of files added.
+    """
+    from .core import supported_ext
+    queue = WorkQueue(queue_file)
+    try:
+        return queue.add(walk_files(folder_path, sub_folders=sub_folders,
+                                    extensions=supported_ext, **filters))
+    finally:
+        queue.close()
+
+def work(queue_file, method='BEST_GUESS', engines=None, workers=4,
+         deadline=None, batch=None, wait=True, rate_share=1):
+    """
+    Renames the files leased from the work queue at 'queue_file' until none
+    is left, and returns the number of files processed by this worker.
+
+    Arguments:
+    - queue_file: path to the SQLite file of the work queue.
+    - workers: number of images renamed concurrently by this process.
+    - batch: number of files leased by this worker at most (default: 2 *
+    workers). More files are leased as soon as no more than 'workers' are
+    left, so that threads never wait for the slowest file of a batch.
+    - wait: when True, the worker waits for the files leased by other workers
+    until they are done, so that the files of a worker which died are renamed
+    once its leases expire. The queue is polled again after 'poll_delay'
+    seconds, doubled after each empty poll up to 'max_poll_delay'.
+    - rate_share: number of processes sharing the request rates of the
+    engines on this machine (see 'search.ratelimit').
+    Other arguments are those of 'img_batch_rename'.
+    """
+    from .core import rename_group
+
+    if rate_share > 1:
+        for host, rate in list(ratelimit.rates.items()):
+            ratelimit.set_rate(host, rate / rate_share)
+    batch = batch or 2 * max(1, workers)
+    queue = WorkQueue(queue_file)
+    owner = worker_id()
+
+    # Leases are extended while the files are being renamed
+    stopped = threading.Event()
+    def heartbeat():
+        while not stopped.wait(workqueue.lease_time / 3):
+            try:
+                queue.heartbeat(owner)
+            except Exception as e:
+                logging.warning('heartbeat: ' + str(e))
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    def task(path):
+        try:
+            (path, new_path), = rename_group([path], method=method,
+                engines=engines, deadline=deadline)
+        except Exception as e:
+            new_path = e
+        if isinstance(new_path, Exception):
+            queue.complete(path, owner, error=new_path)
+        else:
+            queue.complete(path, owner, new_path=new_path)
+
+    workers = max(1, workers)
+    processed = 0
+    running = set()
+    delay = poll_delay
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                if len(running) <= workers:
+                    paths = queue.lease(owner, batch - len(running))
+                    for path in paths:
+                        running.add(executor.submit(task, path))
+                    if paths:
+                        delay = poll_delay
+                if not running:
+                    if not wait or not queue.counts()[LEASED]:
+                        break
+                    time.sleep(delay)
+                    delay = min(2 * delay, max_poll_delay,
+                                workqueue.lease_time / 3)
+                    continue
+                done, running = concurrent.futures.wait(running,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+                processed = processed + len(done)
+    finally:
+        stopped.set()
+        queue.close()
+    return processed
+
+def img_process_rename(folder_path, sub_folders=False, method='BEST_GUESS',
+                       engines=None, processes=None, workers=4, deadline=None,
+                       queue_file=None, **filters):
+    """
+    Renames all images in a folder with several worker processes.
+
+    Arguments:
+    - processes: number of worker processes (default: number of CPUs).
+    - workers: number of images renamed concurrently by each process.
+    - queue_file: (optional) path to the work queue of the batch. A batch
+    interrupted is resumed when the same queue is given again, and other
+    machines may join the batch with 'work'. A temporary queue is used by
+    default.
+    Other arguments are those of 'img_batch_rename'.
+
+    Returns a dictionary mapping each file path to its new path (None if the
+    file was not renamed), or to an exception giving the error met.
+    """
+    if not os.path.isdir(folder_path):
+        logging.error("No valid directory was found.")
+        return {}
+    processes = processes or os.cpu_count() or 1
+
+    temporary = queue_file is None
+    if temporary:
+        fd, queue_file = tempfile.mkstemp(prefix='imgnamer-queue-',
+                                          suffix='.sqlite')
+        os.close(fd)
+    try:
+        enqueue(queue_file, folder_path, sub_folders=sub_folders, **filters)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(work, queue_file, method=method,
+                engines=engines, workers=workers, deadline=deadline,
+                rate_share=processes) for i in range(processes)]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error('worker process: ' + str(e))
+        queue = WorkQueue(queue_file)
+        try:
+            return {path: RuntimeError(error) if error else new_path
+                    for path, new_path, error in queue.results()}
+        finally:
+            queue.close()
+    finally:
+        if temporary:
+            os.remove(queue_file)
@@ -0,0 +1,146 @@
+# This module implements a queue of files shared by several worker processes,
+# possibly on several machines, stored in a single SQLite file. Workers lease
+# batches of files, extend their leases with heartbeats while they work and
+# record the outcome of each file. The leases of a worker which stopped sending
+# heartbeats expire, and its files are leased again by the other workers.
+#
+# Machines sharing a queue must see the files under the same paths and have
+# roughly synchronized clocks. SQLite relies on the locks of the filesystem,
+# which some network filesystems do not implement correctly.
+
+import os
+import time
+import socket
+import sqlite3
+import threading
+
+# States of a file in the queue
+TODO = 'todo'           # Waiting for a worker
+LEASED = 'leased'       # Leased by a worker until 'expires'
+DONE = 'done'           # Renamed, or no name was found
+FAILED = 'failed'       # An error occurred
+
+lease_time = 60         # Seconds a lease lasts without heartbeat
+max_attempts = 3        # Leases of a file before it is considered failed
+
+def worker_id():
+    """Returns a name identifying the current process among all machines."""
+    return socket.gethostname() + ':' + str(os.getpid())
+
+class WorkQueue():
+    """Queue of files leased by workers.
+
+    Arguments:
+        - path: path to the SQLite file of the queue (created if needed)
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS files ('
+            'path TEXT PRIMARY KEY, state TEXT, owner TEXT, expires REAL, '
+            'attempts INTEGER, new_path TEXT, error TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS files_state ON files '
+                         '(state, expires)')
+
+    def add(self, paths, chunk=1000):
+        """
+        Adds files to the queue, ignoring those already in it.
+        Returns the number of files added.
+        """
+        added = 0
+        chunk_paths = []
+        for path in paths:
+            chunk_paths.append((os.path.abspath(path),))
+            if len(chunk_paths) == chunk:
+                added = added + self._insert(chunk_paths)
+                chunk_paths = []
+        return added + self._insert(chunk_paths)
+
+    def _insert(self, rows):
+        if not rows:
+            return 0
+        with self._lock:
+            before = self._db.total_changes
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.executemany('INSERT OR IGNORE INTO files VALUES '
+                    "(?, 'todo', NULL, NULL, 0, NULL, NULL)", rows)
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            return self._db.total_changes - before
+
+    def lease(self, owner, count=1):
+        """
+        Leases at most 'count' files to 'owner' for 'lease_time' seconds, and
+        returns their paths. Files whose lease expired are leased again, up to
+        'max_attempts' times.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute("UPDATE files SET state = 'failed', "
+                    "owner = NULL, error = 'Lease expired too many times' "
+                    "WHERE state = 'leased' AND expires < ? AND attempts >= ?",
+                    (now, max_attempts))
+                paths = [row[0] for row in self._db.execute(
+                    "SELECT path FROM files WHERE state = 'todo' OR "
+                    "(state = 'leased' AND expires < ?) LIMIT ?",
+                    (now, count))]
+                self._db.executemany("UPDATE files SET state = 'leased', "
+                    'owner = ?, expires = ?, attempts = attempts + 1 '
+                    'WHERE path = ?',
+                    [(owner, now + lease_time, path) for path in paths])
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return paths
+
+    def heartbeat(self, owner):
+        """
+        Extends the leases of 'owner'. Returns the number of files leased.
+        """
+        with self._lock:
+            return self._db.execute("UPDATE files SET expires = ? WHERE "
+                "state = 'leased' AND owner = ?",
+                (time.time() + lease_time, owner)).rowcount
+
+    def complete(self, path, owner, new_path=None, error=None):
+        """
+        Records the outcome of a file leased by 'owner'. Outcomes of files
+        whose lease was given to another worker meanwhile are ignored.
+        """
+        with self._lock:
+            self._db.execute('UPDATE files SET state = ?, owner = NULL, '
+                "new_path = ?, error = ? WHERE path = ? AND state = 'leased' "
+                'AND owner = ?', (FAILED if error else DONE, new_path,
+                str(error) if error else None, path, owner))
+
+    def counts(self):
+        """Returns the number of files in each state, as a dictionary."""
+        with self._lock:
+            rows = self._db.execute('SELECT state, COUNT(*) FROM files '
+                                    'GROUP BY state').fetchall()
+        counts = {state: 0 for state in (TODO, LEASED, DONE, FAILED)}
+        counts.update(rows)
+        return counts
+
+    def results(self):
+        """
+        Generates the outcome of the files processed, as (path, new path,
+        error message) tuples. The new path is None when no name was found.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT path, new_path, error FROM files '
+                "WHERE state IN ('done', 'failed')").fetchall()
+        for row in rows:
+            yield row
+
+    def close(self):
+        with self._lock:
+            self._db.close()